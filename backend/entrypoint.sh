@@ -8,6 +8,7 @@ echo "PostgreSQL started"
 
 
 python manage.py migrate
+python manage.py backfill_short_codes
 
 
 python manage.py collectstatic --no-input
@@ -0,0 +1,77 @@
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("foodgram.queries")
+
+
+class QueryCounter:
+    """Обертка execute_wrapper, считающая запросы к БД и их суммарное время."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def get_query_budget(url_name, method):
+    """
+    Допустимое число запросов для маршрута: сначала ищется бюджет
+    вида "PATCH recipe-detail", затем общий для маршрута "recipe-detail".
+    Для маршрутов без бюджета (admin) возвращает None.
+    """
+    budgets = settings.QUERY_BUDGETS
+    return budgets.get(f"{method} {url_name}", budgets.get(url_name))
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы к БД за время обработки запроса.
+
+    При QUERY_COUNT_HEADERS отдает их число и время в заголовках
+    X-DB-Queries и X-DB-Time (мс). При DEBUG пишет предупреждение в лог
+    foodgram.queries, если превышен бюджет маршрута из QUERY_BUDGETS;
+    маршруты без бюджета не проверяются. Если не нужно ни то, ни другое,
+    запросы не считаются.
+    Запросы, выполненные при отдаче StreamingHttpResponse, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (settings.QUERY_COUNT_HEADERS or settings.DEBUG):
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        if settings.QUERY_COUNT_HEADERS:
+            response["X-DB-Queries"] = str(counter.count)
+            response["X-DB-Time"] = f"{counter.duration * 1000:.2f}"
+
+        match = request.resolver_match
+        if settings.DEBUG and match is not None and match.url_name:
+            budget = get_query_budget(match.url_name, request.method)
+            if budget is not None and counter.count > budget:
+                logger.warning(
+                    "%s %s (%s): %d запросов к БД при бюджете %d",
+                    request.method,
+                    request.path,
+                    match.url_name,
+                    counter.count,
+                    budget,
+                )
+        return response
@@ -1,6 +1,159 @@
-from rest_framework.pagination import PageNumberPagination
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = "limit"
     max_page_size = 100
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset-пагинация только вперед по паре (ordering[0], id) по убыванию.
+
+    Курсор хранит значение поля и id последнего объекта страницы, следующая
+    страница выбирается условием (поле, id) < (значение, id), которое
+    обслуживается составным индексом по этой паре. В отличие от
+    CursorPagination, одинаковые значения поля у множества объектов
+    не превращаются в OFFSET.
+    """
+
+    page_size_query_param = "limit"
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.has_previous = False
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_after(queryset, cursor.position))
+        page = list(queryset.order_by(*self.ordering)[: self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[: self.page_size]
+        return self.page
+
+    @property
+    def field_name(self):
+        return self.ordering[0].lstrip("-")
+
+    def parse_value(self, value, field, connection):
+        """
+        Значение поля из курсора в виде параметра запроса. По умолчанию
+        строка преобразуется самим полем модели.
+        """
+        return field.get_db_prep_value(field.to_python(value), connection)
+
+    def format_value(self, value):
+        """Значение поля для курсора."""
+        return str(value)
+
+    def get_after(self, queryset, position):
+        connection = connections[queryset.db]
+        field = queryset.model._meta.get_field(self.field_name)
+        try:
+            value, pk = position.rsplit(":", 1)
+            params = (self.parse_value(value, field, connection), int(pk))
+        except (AttributeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        quote_name = connection.ops.quote_name
+        table = quote_name(queryset.model._meta.db_table)
+        return RawSQL(
+            f"({table}.{quote_name(self.field_name)}, {table}.{quote_name('id')}) "
+            "< (%s, %s)",
+            params,
+            output_field=BooleanField(),
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        value = self.format_value(getattr(last, self.field_name))
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=f"{value}:{last.pk}")
+        )
+
+    def get_previous_link(self):
+        return None
+
+
+class RecipeCursorPagination(KeysetPagination):
+    """
+    Лента рецептов по (created_at, id), совпадает с Recipe.Meta.ordering
+    и индексом recipe_created_at_id_idx.
+    """
+
+    ordering = ("-created_at", "-id")
+
+    def parse_value(self, value, field, connection):
+        created_at = datetime.fromisoformat(value)
+        if timezone.is_naive(created_at):
+            raise ValueError(value)
+        return connection.ops.adapt_datetimefield_value(created_at)
+
+    def format_value(self, value):
+        return value.isoformat()
+
+
+class RecipePopularPagination(KeysetPagination):
+    """Рецепты по (popularity, id), индекс recipe_popularity_id_idx."""
+
+    ordering = ("-popularity", "-id")
+
+
+class RecipePagination(CustomPagination):
+    """
+    Постраничная пагинация page/limit с опциональным курсорным режимом.
+
+    Курсорный режим включается параметром ?pagination=cursor или наличием
+    параметра cursor и не требует ни OFFSET, ни COUNT(*) по всей таблице.
+    Он доступен только для сортировки по умолчанию: если queryset
+    отсортирован иначе, используется обычная постраничная пагинация.
+    Сортировка по популярности всегда использует курсор
+    RecipePopularPagination: постраничный режим для нее потребовал бы
+    OFFSET по индексу и COUNT(*).
+    """
+
+    mode_query_param = "pagination"
+    cursor_class = RecipeCursorPagination
+    popular_class = RecipePopularPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def get_cursor_class(self, queryset, request):
+        """Класс курсорной пагинации для queryset или None."""
+        order_by = tuple(queryset.query.order_by)
+        if order_by == self.popular_class.ordering:
+            return self.popular_class
+        requested = (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or self.cursor_class.cursor_query_param in request.query_params
+        )
+        return self.cursor_class if requested and not order_by else None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_class = self.get_cursor_class(queryset, request)
+        if cursor_class is not None:
+            self.cursor_paginator = cursor_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_html_context()
+        return super().get_html_context()
@@ -29,6 +29,11 @@ DEBUG = True
 ALLOWED_HOSTS = []
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Картинки хранятся под именами по содержимому, одинаковые - одним файлом
+STORAGES = {
+    "default": {"BACKEND": "utils.storage.HashedFileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
@@ -40,6 +45,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "users.apps.UsersConfig",
     "recipes.apps.RecipesConfig",
     "ingredients.apps.IngredientsConfig",
@@ -81,6 +87,7 @@ DJOSER = {
 AUTH_USER_MODEL = "users.User"
 
 MIDDLEWARE = [
+    "foodgram_backend.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -126,6 +133,93 @@ DATABASES = {
     }
 }
 
+# Кэш должен быть общим для всех процессов: в нем хранятся версии данных
+# (ингредиентов, рецептов), по которым процессы сбрасывают свои копии
+# в памяти. LocMemCache подходит только для разработки в одном процессе
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Время жизни закэшированного представления рецепта и кода его короткой
+# ссылки (секунды)
+RECIPE_CACHE_TIMEOUT = int(os.getenv("RECIPE_CACHE_TIMEOUT", 60 * 60))
+
+# Период полураспада популярности рецептов (дни) для команды
+# decay_popularity; 0 отключает затухание
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv("POPULARITY_HALF_LIFE_DAYS", 7))
+
+# Ограничения картинок в base64: размер после декодирования (байты)
+# и число пикселей
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv("MAX_IMAGE_UPLOAD_SIZE", 10 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 40_000_000))
+
+# Каталог незавершенных загрузок картинок по частям. Он вне MEDIA_ROOT:
+# непроверенные файлы не должны раздаваться nginx
+IMAGE_UPLOAD_DIR = os.getenv("IMAGE_UPLOAD_DIR", os.path.join(BASE_DIR, "uploads"))
+
+# Уменьшенные копии картинок рецептов: размер -> наибольшая сторона (px)
+IMAGE_VARIANTS = {"small": 320, "medium": 960}
+
+# TrueType-шрифт с кириллицей для выгрузки списка покупок в PDF
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    "SHOPPING_LIST_PDF_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
+# Заголовки X-DB-Queries и X-DB-Time с числом и временем запросов к БД
+QUERY_COUNT_HEADERS = os.getenv("QUERY_COUNT_HEADERS", "false").lower() == "true"
+
+# Бюджеты запросов к БД по имени маршрута, при DEBUG превышение пишется
+# в лог. Маршруты без бюджета (admin) не проверяются
+QUERY_BUDGETS = {
+    "api-root": 1,
+    "recipe-list": 5,
+    "recipe-detail": 4,
+    "POST recipe-list": 12,
+    # Изменение рецепта рассчитано на худший случай разницы ингредиентов,
+    # когда есть и вставка, и изменение, и удаление строк
+    "PATCH recipe-detail": 18,
+    "PUT recipe-detail": 18,
+    "DELETE recipe-detail": 13,
+    "recipe-favorite": 4,
+    "recipe-shopping-cart": 7,
+    "recipe-popular": 4,
+    "recipe-favorite-bulk": 4,
+    "recipe-shopping-cart-bulk": 7,
+    "recipe-get-link": 2,
+    "short-link": 1,
+    "recipe-download-shopping-cart": 3,
+    "upload-list": 2,
+    "upload-detail": 2,
+    "DELETE upload-detail": 3,
+    "ingredient-list": 2,
+    "ingredient-detail": 2,
+    "subscription-list": 6,
+    "users-subscribe": 4,
+    "POST users-subscribe": 9,
+    "users-avatar": 5,
+    "users-list": 5,
+    "users-detail": 3,
+    "user-list": 5,
+    "POST user-list": 3,
+    "user-detail": 3,
+    "user-me": 2,
+    "user-set-password": 2,
+    "user-set-username": 2,
+    "user-activation": 2,
+    "user-resend-activation": 2,
+    "user-reset-password": 2,
+    "user-reset-password-confirm": 2,
+    "user-reset-username": 2,
+    "user-reset-username-confirm": 2,
+    "login": 6,
+    "logout": 2,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,48 @@
+import base64
+import io
+from urllib.parse import urlsplit
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, resolve
+from PIL import Image
+from .middleware import get_query_budget
+
+
+def make_image():
+    """Картинка 2x2 в виде data URI для полей Base64ImageField."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (2, 2), color=(255, 0, 0)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def get_route_names(patterns=None, exclude=("admin",)):
+    """Имена всех маршрутов из foodgram_backend/urls.py, кроме exclude."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.app_name not in exclude:
+                names |= get_route_names(pattern.url_patterns, exclude)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class QueryBudgetTestMixin:
+    """Проверка числа запросов к БД по бюджетам из settings.QUERY_BUDGETS."""
+
+    def assertWithinQueryBudget(self, method, path, **kwargs):
+        url_name = resolve(urlsplit(path).path).url_name
+        budget = get_query_budget(url_name, method.upper())
+        self.assertIsNotNone(budget, f"Нет бюджета для {method} {url_name}")
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method.lower())(path, **kwargs)
+        self.assertLessEqual(
+            len(context),
+            budget,
+            f"{method} {path} ({url_name}): {len(context)} запросов к БД "
+            f"при бюджете {budget}:\n"
+            + "\n".join(query["sql"] for query in context.captured_queries),
+        )
+        return response
@@ -0,0 +1,290 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from ingredients.models import Ingredient
+from recipes.models import Recipe, RecipeIngredient
+from users.models import User, Subscription
+from utils.serializers import Base64ImageField
+from utils.storage import HashedFileSystemStorage
+from .testing import QueryBudgetTestMixin, get_route_names, make_image
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, IMAGE_UPLOAD_DIR=os.path.join(MEDIA_ROOT, "uploads")
+)
+class QueryBudgetTest(QueryBudgetTestMixin, APITestCase):
+    """Каждый маршрут API укладывается в бюджет запросов к БД."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        cls.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f"ингредиент{i}", measurement_unit="г")
+            for i in range(10)
+        ]
+        for i in range(6):
+            recipe = Recipe.objects.create(
+                author=cls.author,
+                name=f"Рецепт {i}",
+                image="recipes/test.jpg",
+                text="Описание",
+                cooking_time=10,
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+                for ingredient in cls.ingredients
+            )
+        cls.recipe = recipe
+        Subscription.objects.create(user=cls.user, subscriber=cls.author)
+
+    def setUp(self):
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_every_route_has_budget(self):
+        route_names = {budget.split()[-1] for budget in settings.QUERY_BUDGETS}
+        self.assertEqual(get_route_names() - route_names, set())
+
+    def test_read_routes(self):
+        recipe_url = f"/api/recipes/{self.recipe.id}/"
+        for path in (
+            "/api/",
+            "/api/recipes/",
+            "/api/recipes/?limit=100",
+            "/api/recipes/popular/?limit=100",
+            recipe_url,
+            f"{recipe_url}get-link/",
+            "/api/recipes/download_shopping_cart/",
+            "/api/ingredients/",
+            f"/api/ingredients/{self.ingredients[0].id}/",
+            "/api/users/",
+            f"/api/users/{self.author.id}/",
+            "/api/users/me/",
+            "/api/users/subscriptions/",
+        ):
+            response = self.assertWithinQueryBudget("GET", path)
+            self.assertEqual(response.status_code, 200, path)
+
+    def test_recipe_write_routes(self):
+        recipe_data = {
+            "name": "Новый рецепт",
+            "text": "Описание",
+            "cooking_time": 5,
+            "image": make_image(),
+            "ingredients": [
+                {"id": ingredient.id, "amount": 2} for ingredient in self.ingredients
+            ],
+        }
+        response = self.assertWithinQueryBudget(
+            "POST", "/api/recipes/", data=recipe_data, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        recipe_id = response.data["id"]
+        recipe_url = f"/api/recipes/{recipe_id}/"
+        recipe_data["ingredients"][0]["amount"] = 3
+        response = self.assertWithinQueryBudget(
+            "PATCH", recipe_url, data=recipe_data, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        for action in ("favorite", "shopping_cart"):
+            response = self.assertWithinQueryBudget("POST", f"{recipe_url}{action}/")
+            self.assertEqual(response.status_code, 201)
+            response = self.assertWithinQueryBudget("DELETE", f"{recipe_url}{action}/")
+            self.assertEqual(response.status_code, 204)
+            for method in ("POST", "DELETE"):
+                response = self.assertWithinQueryBudget(
+                    method,
+                    f"/api/recipes/{action}/",
+                    data={"recipes": [recipe_id, recipe_id + 1]},
+                    format="json",
+                )
+                self.assertEqual(response.status_code, 200)
+        response = self.assertWithinQueryBudget("DELETE", recipe_url)
+        self.assertEqual(response.status_code, 204)
+
+    def test_user_write_routes(self):
+        subscribe_url = f"/api/users/{self.author.id}/subscribe/"
+        response = self.assertWithinQueryBudget("DELETE", subscribe_url)
+        self.assertEqual(response.status_code, 204)
+        response = self.assertWithinQueryBudget("POST", subscribe_url)
+        self.assertEqual(response.status_code, 201)
+        response = self.assertWithinQueryBudget(
+            "PUT", "/api/users/me/avatar/", data={"avatar": make_image()}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertWithinQueryBudget("DELETE", "/api/users/me/avatar/")
+        self.assertEqual(response.status_code, 204)
+        image = base64.b64decode(make_image().split(",", 1)[1])
+        for avatar in (True, False):
+            response = self.assertWithinQueryBudget(
+                "POST", "/api/uploads/", data={"size": len(image)}, format="json"
+            )
+            self.assertEqual(response.status_code, 201)
+            upload_url = f"/api/uploads/{response.data['token']}/"
+            response = self.assertWithinQueryBudget(
+                "PATCH",
+                upload_url,
+                data=image,
+                content_type="application/offset+octet-stream",
+                HTTP_UPLOAD_OFFSET="0",
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.assertWithinQueryBudget("GET", upload_url)
+            self.assertEqual(response.status_code, 200)
+            if avatar:
+                response = self.assertWithinQueryBudget(
+                    "PUT",
+                    "/api/users/me/avatar/",
+                    data={"avatar": response.data["token"]},
+                    format="json",
+                )
+                self.assertEqual(response.status_code, 200)
+            else:
+                response = self.assertWithinQueryBudget("DELETE", upload_url)
+                self.assertEqual(response.status_code, 204)
+        response = self.assertWithinQueryBudget(
+            "POST",
+            "/api/users/set_password/",
+            data={"current_password": "password123", "new_password": "Pa55-word-42"},
+        )
+        self.assertEqual(response.status_code, 204)
+        for path in (
+            "/api/users/activation/",
+            "/api/users/resend_activation/",
+            "/api/users/reset_password/",
+            "/api/users/reset_password_confirm/",
+            "/api/users/reset_username/",
+            "/api/users/reset_username_confirm/",
+            "/api/users/set_username/",
+        ):
+            self.assertWithinQueryBudget("POST", path, data={})
+
+    def test_auth_routes(self):
+        self.client.credentials()
+        response = self.assertWithinQueryBudget(
+            "POST",
+            "/api/users/",
+            data={
+                "email": "new@example.com",
+                "username": "new_user",
+                "first_name": "Имя",
+                "last_name": "Фамилия",
+                "password": "Pa55-word-42",
+            },
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.assertWithinQueryBudget(
+            "POST",
+            "/api/auth/token/login/",
+            data={"email": "new@example.com", "password": "Pa55-word-42"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {response.data['auth_token']}"
+        )
+        response = self.assertWithinQueryBudget("POST", "/api/auth/token/logout/")
+        self.assertEqual(response.status_code, 204)
+
+    @override_settings(
+        DEBUG=True, QUERY_COUNT_HEADERS=True, QUERY_BUDGETS={"recipe-list": 0}
+    )
+    def test_middleware_headers_and_warning(self):
+        with self.assertLogs("foodgram.queries", level="WARNING"):
+            response = self.client.get("/api/recipes/")
+        self.assertGreater(int(response["X-DB-Queries"]), 0)
+        self.assertIn("X-DB-Time", response)
+        # Маршруты без бюджета не проверяются
+        with mock.patch("foodgram_backend.middleware.logger") as logger:
+            self.client.get("/api/users/")
+        logger.warning.assert_not_called()
+
+    @override_settings(QUERY_BUDGETS={"recipe-list": 0})
+    def test_middleware_is_off_without_debug(self):
+        with mock.patch("foodgram_backend.middleware.logger") as logger:
+            response = self.client.get("/api/recipes/")
+        logger.warning.assert_not_called()
+        self.assertNotIn("X-DB-Queries", response)
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+    def decode(self, data):
+        return Base64ImageField().to_internal_value(data)
+
+    def test_valid_image(self):
+        image = self.decode(make_image())
+        self.assertTrue(image.name.endswith(".png"))
+        self.assertEqual(image.read(8), b"\x89PNG\r\n\x1a\n")
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_large_image_is_decoded_to_disk(self):
+        image = self.decode(make_image())
+        self.assertTrue(os.path.exists(image.temporary_file_path()))
+        self.assertEqual(image.size, os.path.getsize(image.temporary_file_path()))
+
+    def test_format_comes_from_content(self):
+        # Заявленный тип не важен, расширение берется по сигнатуре
+        image = self.decode(make_image().replace("image/png", "image/jpeg"))
+        self.assertTrue(image.name.endswith(".png"))
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=30)
+    def test_oversized_payload_is_rejected_before_decoding(self):
+        with self.assertRaisesMessage(ValidationError, "Размер картинки превышает"):
+            self.decode("data:image/png;base64," + "!" * 100)
+
+    @override_settings(MAX_IMAGE_PIXELS=3)
+    def test_too_many_pixels(self):
+        with self.assertRaisesMessage(ValidationError, "пикселей"):
+            self.decode(make_image())
+
+    def test_invalid_payloads(self):
+        for data in (
+            "data:image/png;base64,не base64",
+            "data:image/png,abcd",
+            "data:image/png;base64," + base64.b64encode(b"GIF8" + b"0" * 20).decode(),
+            "data:image/png;base64," + base64.b64encode(b"text" * 10).decode(),
+        ):
+            with self.assertRaises(ValidationError, msg=data):
+                self.decode(data)
+
+
+class HashedFileSystemStorageTest(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        self.storage = HashedFileSystemStorage(location=self.location)
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save("recipes/a.PNG", ContentFile(b"content"))
+        second = self.storage.save("recipes/b.png", ContentFile(b"content"))
+        other = self.storage.save("recipes/c.png", ContentFile(b"other"))
+        digest = hashlib.sha256(b"content").hexdigest()
+        self.assertEqual(first, f"recipes/{digest[:2]}/{digest}.png")
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(
+            sorted(os.listdir(self.storage.path(f"recipes/{digest[:2]}"))),
+            [f"{digest}.png"],
+        )
+        with self.storage.open(first) as file:
+            self.assertEqual(file.read(), b"content")
@@ -16,13 +16,15 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.http import JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from users.models import User, Subscription
 from subscriptions.serializers import SubscriptionSerializer
 from rest_framework.pagination import PageNumberPagination
+from recipes.models import SHORT_CODE_LENGTH
+from recipes.views import redirect_short_link
 
 
 urlpatterns = [
@@ -32,4 +34,9 @@ urlpatterns = [
     path("api/", include("users.urls")),
     path("api/", include("ingredients.urls")),
     path("api/", include("recipes.urls")),
+    re_path(
+        rf"^s/(?P<code>[0-9A-Za-z]{{{SHORT_CODE_LENGTH}}})/?$",
+        redirect_short_link,
+        name="short-link",
+    ),
 ]
@@ -0,0 +1,35 @@
+import time
+from django.core.cache import cache
+from .models import Ingredient
+
+INGREDIENTS_VERSION_KEY = "ingredients:version"
+
+# id ингредиентов, загруженные процессом, и версия данных, к которой они относятся
+_known_ingredient_ids = {"version": None, "ids": frozenset()}
+
+
+def get_ingredients_version():
+    """Версия данных таблицы ингредиентов, меняется при любом ее изменении."""
+    version = cache.get(INGREDIENTS_VERSION_KEY)
+    if version is None:
+        cache.add(INGREDIENTS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(INGREDIENTS_VERSION_KEY)
+    return version
+
+
+def bump_ingredients_version():
+    cache.set(INGREDIENTS_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_known_ingredient_ids():
+    """
+    Множество id ингредиентов, хранящееся в памяти процесса.
+    Перечитывается из БД, только когда меняется версия данных.
+    """
+    version = get_ingredients_version()
+    if _known_ingredient_ids["version"] != version:
+        _known_ingredient_ids.update(
+            version=version,
+            ids=frozenset(Ingredient.objects.values_list("id", flat=True)),
+        )
+    return _known_ingredient_ids["ids"]
@@ -0,0 +1,44 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from django.db.models.functions import Upper
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    """
+    Индекс с классом операторов PostgreSQL. В остальных СУБД (SQLite
+    в тестах) он только добавляется в состояние моделей.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ingredients", "0001_initial"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddPostgresIndex(
+            model_name="ingredient",
+            index=models.Index(
+                OpClass(Upper("name"), name="varchar_pattern_ops"),
+                name="ingredient_name_pattern_idx",
+            ),
+        ),
+        AddPostgresIndex(
+            model_name="ingredient",
+            index=GinIndex(
+                OpClass("name", name="gin_trgm_ops"),
+                name="ingredient_name_trgm_idx",
+            ),
+        ),
+    ]
@@ -1,10 +1,41 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections, models
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Upper
+
+
+class IngredientQuerySet(models.QuerySet):
+    def fuzzy_search(self, text):
+        """
+        Поиск с опечатками: сначала ингредиенты, название которых
+        начинается с text, затем похожие по триграммам (pg_trgm) по
+        убыванию сходства.
+
+        В PostgreSQL условия обслуживают индексы из Meta.indexes:
+        по UPPER(name) с varchar_pattern_ops и GIN-индекс триграмм.
+        В остальных СУБД ищется подстрока.
+        """
+        is_prefix = Case(When(name__istartswith=text, then=Value(1)), default=Value(0))
+        if connections[self.db].vendor == "postgresql":
+            queryset = self.filter(
+                Q(name__istartswith=text) | Q(name__trigram_word_similar=text)
+            )
+            similarity = TrigramWordSimilarity(text, "name")
+        else:
+            queryset = self.filter(name__icontains=text)
+            similarity = Value(0.0)
+        return queryset.annotate(is_prefix=is_prefix, similarity=similarity).order_by(
+            "-is_prefix", "-similarity", "name"
+        )
 
 
 class Ingredient(models.Model):
     name = models.CharField(max_length=200, verbose_name="Название", db_index=True)
     measurement_unit = models.CharField(max_length=50, verbose_name="Единица измерения")
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
@@ -13,6 +44,21 @@ class Ingredient(models.Model):
                 fields=["name", "measurement_unit"], name="unique_ingredient"
             )
         ]
+        # Создаются только в PostgreSQL, см. миграцию 0002.
+        # istartswith компилируется в UPPER(name::text) LIKE UPPER('x%'): такое
+        # условие может использовать только индекс по тому же выражению, а при
+        # локали, отличной от C, - еще и с классом операторов *_pattern_ops.
+        # Триграммный GIN-индекс обслуживает поиск с опечатками (%>).
+        indexes = [
+            models.Index(
+                OpClass(Upper("name"), name="varchar_pattern_ops"),
+                name="ingredient_name_pattern_idx",
+            ),
+            GinIndex(
+                OpClass("name", name="gin_trgm_ops"),
+                name="ingredient_name_trgm_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.measurement_unit})"
@@ -0,0 +1,53 @@
+import bisect
+from .cache import get_ingredients_version
+from .models import Ingredient
+
+# Индекс, построенный процессом, и версия данных, к которой он относится
+_ingredient_index = {"version": None, "index": None}
+
+
+def normalize_name(name):
+    """Название для поиска: без учета регистра, «ё» не отличается от «е»."""
+    return name.casefold().replace("ё", "е")
+
+
+class IngredientIndex:
+    """
+    Отсортированный список нормализованных названий ингредиентов для
+    автодополнения. Ингредиенты с названием, начинающимся с префикса,
+    занимают в нем непрерывный отрезок, который находится двоичным
+    поиском. Первыми в отрезке идут точные совпадения, затем остальные
+    по алфавиту, поэтому первые limit совпадений берутся без сортировки.
+    """
+
+    def __init__(self, rows):
+        # Строки в порядке id, как в ответе без фильтра
+        self.rows = rows
+        entries = sorted(
+            (normalize_name(row["name"]), position) for position, row in enumerate(rows)
+        )
+        self.names = [name for name, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    def search(self, prefix, limit=None):
+        prefix = normalize_name(prefix)
+        start = bisect.bisect_left(self.names, prefix)
+        # Все строки с префиксом меньше prefix + наибольший символ Unicode
+        end = bisect.bisect_left(self.names, prefix + "\U0010ffff", start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [self.rows[position] for position in self.positions[start:end]]
+
+
+def get_ingredient_index():
+    """
+    Индекс ингредиентов в памяти процесса. Строится при первом обращении
+    и перестраивается, только когда меняется версия данных.
+    """
+    version = get_ingredients_version()
+    if _ingredient_index["version"] != version:
+        rows = list(
+            Ingredient.objects.order_by("id").values("id", "name", "measurement_unit")
+        )
+        _ingredient_index.update(version=version, index=IngredientIndex(rows))
+    return _ingredient_index["index"]
@@ -0,0 +1,88 @@
+from unittest import skipUnless
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from rest_framework.test import APITestCase
+from .models import Ingredient
+from .search import IngredientIndex
+
+
+class IngredientSearchTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in (
+            "Ёжевика",
+            "ежевика",
+            "Соль",
+            "соль морская",
+            "солод",
+            "сахар",
+            "морковь",
+        ):
+            Ingredient.objects.create(name=name, measurement_unit="г")
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get(f"/api/ingredients/?{query}")
+        self.assertEqual(response.status_code, 200)
+        return [ingredient["name"] for ingredient in response.data]
+
+    def test_prefix_search(self):
+        self.assertEqual(self.search("name=СОЛ"), ["солод", "Соль", "соль морская"])
+        self.assertEqual(self.search("name=соль"), ["Соль", "соль морская"])
+        self.assertEqual(self.search("search=сол&limit=1"), ["солод"])
+        self.assertEqual(self.search("name=ёж"), ["Ёжевика", "ежевика"])
+        self.assertEqual(self.search("name=перец"), [])
+        self.assertEqual(len(self.search("")), 7)
+        self.assertEqual(len(self.search("limit=2")), 2)
+        response = self.client.get("/api/ingredients/?name=с&limit=0")
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_is_built_once_per_version(self):
+        self.search("name=с")
+        with self.assertNumQueries(0):
+            self.search("name=со")
+        Ingredient.objects.create(name="Сода", measurement_unit="г")
+        self.assertEqual(self.search("name=сод"), ["Сода"])
+
+    def test_exact_match_comes_first(self):
+        index = IngredientIndex(
+            [
+                {"id": 1, "name": "Соль морская", "measurement_unit": "г"},
+                {"id": 2, "name": "соль", "measurement_unit": "г"},
+                {"id": 3, "name": "Сол", "measurement_unit": "г"},
+            ]
+        )
+        self.assertEqual([row["id"] for row in index.search("сол")], [3, 2, 1])
+        self.assertEqual([row["id"] for row in index.search("соль", 1)], [2])
+
+    def test_fuzzy_mode(self):
+        # Сначала совпадения по началу названия, затем остальные
+        self.assertEqual(self.search("name=мор&fuzzy=1"), ["морковь", "соль морская"])
+        self.assertEqual(self.search("name=мор&fuzzy=1&limit=1"), ["морковь"])
+
+
+@skipUnless(connection.vendor == "postgresql", "Индексы есть только в PostgreSQL")
+class IngredientIndexUsageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {number}", measurement_unit="г")
+            for number in range(200)
+        )
+
+    def setUp(self):
+        # В маленькой таблице планировщик иначе выбрал бы полный просмотр
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_prefix_search_uses_pattern_index(self):
+        plan = Ingredient.objects.filter(name__istartswith="ингр").explain()
+        self.assertIn("ingredient_name_pattern_idx", plan)
+
+    def test_fuzzy_search_uses_indexes(self):
+        plan = Ingredient.objects.fuzzy_search("ингридиент").explain()
+        self.assertIn("ingredient_name_pattern_idx", plan)
+        self.assertIn("ingredient_name_trgm_idx", plan)
@@ -1,7 +1,11 @@
 from rest_framework import viewsets
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from utils.http import conditional_response, make_etag, set_validators
+from .cache import get_ingredients_version
 from .models import Ingredient
+from .search import get_ingredient_index
 from .serializers import IngredientSerializer
 
 
@@ -9,13 +13,50 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
-    filter_backends = [SearchFilter]
-    search_fields = ["^name"]
     pagination_class = None
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        name_filter = self.request.query_params.get("name")
-        if name_filter:
-            queryset = queryset.filter(name__istartswith=name_filter)
-        return queryset
+    def get_limit(self):
+        limit = self.request.query_params.get("limit")
+        if limit is None:
+            return None
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise ValidationError({"limit": "Укажите положительное число."})
+        return limit
+
+    def get_etag(self):
+        # ETag относится к конкретному URL, поэтому параметры запроса не нужны
+        return make_etag("ingredients", get_ingredients_version())
+
+    def list(self, request, *args, **kwargs):
+        """
+        Ингредиенты, название которых начинается с ?name= (или ?search=),
+        из индекса в памяти процесса, без запросов к БД. Сначала точные
+        совпадения, затем по алфавиту; ?limit= ограничивает их число.
+        С ?fuzzy=1 поиск идет в БД и находит названия с опечатками,
+        см. IngredientQuerySet.fuzzy_search.
+        """
+        etag = self.get_etag()
+        not_modified = conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+        limit = self.get_limit()
+        prefix = request.query_params.get("name") or request.query_params.get("search")
+        if prefix and request.query_params.get("fuzzy") == "1":
+            queryset = self.get_queryset().fuzzy_search(prefix)[:limit]
+            ingredients = self.get_serializer(queryset, many=True).data
+        elif prefix:
+            ingredients = get_ingredient_index().search(prefix, limit)
+        else:
+            ingredients = get_ingredient_index().rows[:limit]
+        return set_validators(Response(ingredients), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.get_etag()
+        not_modified = conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+        return set_validators(super().retrieve(request, *args, **kwargs), etag)
@@ -1,5 +1,18 @@
 from django.contrib import admin
-from .models import Recipe, RecipeIngredient, Favorite, ShoppingCart
+from django.db import transaction
+from users.models import User
+from .cache import invalidate_recipes
+from .counters import change_counter, change_recipe_counters, delete_recipe
+from .images import enqueue_image_variants
+from .models import (
+    Favorite,
+    ImageUpload,
+    Recipe,
+    RecipeImageTask,
+    RecipeIngredient,
+    ShoppingCart,
+)
+from .shopping_list import change_recipes_in_shopping_lists, change_shopping_lists
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -10,13 +23,65 @@ class RecipeIngredientInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "author", "cooking_time", "created_at")
+    list_display = (
+        "id",
+        "name",
+        "author",
+        "cooking_time",
+        "favorites_count",
+        "created_at",
+    )
     list_filter = ("author", "created_at")
     search_fields = ("name", "author__username")
     inlines = (RecipeIngredientInline,)
     ordering = ("-created_at",)
     empty_value_display = "-пусто-"
 
+    # Изменения в admin поддерживают те же производные данные, что и API:
+    # счетчик рецептов автора, суммы списков покупок и копии картинки.
+    # changeform_view и delete_view уже выполняются в транзакции
+
+    def save_model(self, request, obj, form, change):
+        # Новой картинке нужны новые копии, как при изменении через API
+        if "image" in form.changed_data:
+            obj.image_variants = {}
+        super().save_model(request, obj, form, change)
+        if "image" in form.changed_data:
+            enqueue_image_variants(obj)
+        if not change:
+            change_counter(User.objects.filter(pk=obj.author_id), "recipes_count", 1)
+        elif "author" in form.changed_data:
+            change_counter(
+                User.objects.filter(pk=form.initial["author"]), "recipes_count", -1
+            )
+            change_counter(User.objects.filter(pk=obj.author_id), "recipes_count", 1)
+
+    def save_related(self, request, form, formsets, change):
+        ingredients = form.instance.recipe_ingredients.values_list(
+            "ingredient_id", "amount"
+        )
+        before = dict(ingredients)
+        super().save_related(request, form, formsets, change)
+        after = dict(ingredients.all())
+        change_shopping_lists(
+            list(form.instance.shopping_cart.values_list("user_id", flat=True)),
+            {
+                ingredient_id: after.get(ingredient_id, 0)
+                - before.get(ingredient_id, 0)
+                for ingredient_id in before.keys() | after.keys()
+            },
+        )
+
+    def delete_model(self, request, obj):
+        version = (obj.pk, obj.updated_at)
+        delete_recipe(obj)
+        transaction.on_commit(lambda: invalidate_recipes([version]))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        for recipe in queryset:
+            self.delete_model(request, recipe)
+
 
 @admin.register(RecipeIngredient)
 class RecipeIngredientAdmin(admin.ModelAdmin):
@@ -25,18 +90,84 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     search_fields = ("recipe__name", "ingredient__name")
     empty_value_display = "-пусто-"
 
+    # Ингредиенты добавляются и меняются только на странице рецепта, где
+    # вместе с ними обновляются списки покупок
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        change_shopping_lists(
+            list(obj.recipe.shopping_cart.values_list("user_id", flat=True)),
+            {obj.ingredient_id: -obj.amount},
+        )
+        obj.delete()
+        # Ингредиенты входят в представление рецепта
+        obj.recipe.save(update_fields=["updated_at"])
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        for item in queryset:
+            self.delete_model(request, item)
+
+
+class UserRecipeAdmin(admin.ModelAdmin):
+    """
+    Избранное и список покупок. Добавление и удаление меняют счетчики
+    рецептов и списки покупок так же, как API; изменять связь нельзя,
+    ее можно удалить и добавить заново.
+    """
 
-@admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "recipe")
     list_filter = ("user", "recipe")
     search_fields = ("user__username", "recipe__name")
     empty_value_display = "-пусто-"
+    after_change = None
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        change_recipe_counters(self.model, [obj.recipe_id], 1)
+        if self.after_change is not None:
+            self.after_change([obj.recipe_id], [obj.user_id], sign=1)
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        recipe_ids = {}
+        for user_id, recipe_id in queryset.values_list("user_id", "recipe_id"):
+            recipe_ids.setdefault(user_id, []).append(recipe_id)
+        for user_id, user_recipe_ids in recipe_ids.items():
+            removed = self.model.objects.remove_recipes(user_id, user_recipe_ids)
+            change_recipe_counters(self.model, removed, -1)
+            if removed and self.after_change is not None:
+                self.after_change(list(removed), [user_id], sign=-1)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(UserRecipeAdmin):
+    pass
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "recipe")
-    list_filter = ("user", "recipe")
-    search_fields = ("user__username", "recipe__name")
+class ShoppingCartAdmin(UserRecipeAdmin):
+    after_change = staticmethod(change_recipes_in_shopping_lists)
+
+
+@admin.register(RecipeImageTask)
+class RecipeImageTaskAdmin(admin.ModelAdmin):
+    list_display = ("id", "recipe", "image", "attempts", "locked_until")
     empty_value_display = "-пусто-"
+
+
+@admin.register(ImageUpload)
+class ImageUploadAdmin(admin.ModelAdmin):
+    list_display = ("id", "token", "user", "size", "created_at")
+    search_fields = ("user__username",)
@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Recipe
+
+# Версия формата закэшированного представления: увеличивается при изменении
+# полей RecipeSerializer, чтобы не отдавать записи в старом формате.
+RECIPE_CACHE_VERSION = 3
+
+
+def recipe_cache_key(recipe_id, updated_at):
+    """
+    Ключ включает updated_at: любое изменение рецепта его обновляет, поэтому
+    записи о старых версиях перестают читаться сами, даже если изменение
+    сделано в другом процессе (обработчик картинок, команды, admin) или
+    параллельный запрос положил в кэш представление, собранное до него.
+    """
+    return f"recipe:v{RECIPE_CACHE_VERSION}:{recipe_id}:{updated_at.timestamp()}"
+
+
+def get_recipe_payloads(recipes):
+    """
+    Возвращает закэшированные представления рецептов одним multi-get.
+    У рецептов должен быть загружен updated_at.
+    """
+    keys = {
+        recipe_cache_key(recipe.pk, recipe.updated_at): recipe.pk for recipe in recipes
+    }
+    cached = cache.get_many(keys)
+    return {keys[key]: payload for key, payload in cached.items()}
+
+
+def set_recipe_payloads(payloads):
+    """payloads - пары (рецепт, представление), собранное из этого рецепта."""
+    cache.set_many(
+        {
+            recipe_cache_key(recipe.pk, recipe.updated_at): payload
+            for recipe, payload in payloads
+        },
+        timeout=settings.RECIPE_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_recipes(versions):
+    """
+    Удаляет записи об устаревших версиях (id, updated_at). Корректность
+    от этого не зависит, записи удаляются только чтобы не занимать память
+    до истечения RECIPE_CACHE_TIMEOUT.
+    """
+    cache.delete_many(
+        [recipe_cache_key(recipe_id, updated_at) for recipe_id, updated_at in versions]
+    )
+
+
+def touch_recipes(recipes):
+    """
+    Обновляет updated_at рецептов queryset recipes после изменения данных,
+    которые входят в их представление, но хранятся в других таблицах:
+    от updated_at зависят ключи кэша, ETag и Last-Modified.
+    """
+    versions = list(recipes.values_list("id", "updated_at"))
+    Recipe.objects.filter(pk__in=[pk for pk, _ in versions]).update(
+        updated_at=timezone.now()
+    )
+    invalidate_recipes(versions)
+
+
+def invalidate_author_recipes(author):
+    """Обновляет рецепты автора после изменения его профиля."""
+    touch_recipes(Recipe.objects.filter(author=author))
+
+
+def short_code_cache_key(code):
+    return f"short-code:{code}"
+
+
+def resolve_short_code(code):
+    """
+    Id рецепта по коду короткой ссылки. Найденные коды кэшируются в общем
+    кэше и удаляются из него вместе с рецептом (signals.recipe_deleted).
+    Отсутствующий код вызывает Recipe.DoesNotExist и не кэшируется,
+    поэтому перебор случайных кодов не вытесняет настоящие.
+    """
+    key = short_code_cache_key(code)
+    recipe_id = cache.get(key)
+    if recipe_id is None:
+        recipe_id = Recipe.objects.values_list("pk", flat=True).get(short_code=code)
+        cache.set(key, recipe_id, settings.RECIPE_CACHE_TIMEOUT)
+    return recipe_id
+
+
+def forget_short_code(code):
+    cache.delete(short_code_cache_key(code))
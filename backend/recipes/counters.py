@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from users.models import User, Subscription
+from .models import Recipe, Favorite, ShoppingCart
+from .shopping_list import change_recipes_in_shopping_lists
+
+# Счетчик: (модель со счетчиком, поле, модель связей, поле связи с моделью)
+COUNTERS = (
+    (Recipe, "favorites_count", Favorite, "recipe"),
+    (Recipe, "in_carts_count", ShoppingCart, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "subscribers_count", Subscription, "subscriber"),
+)
+
+# Счетчики рецепта для моделей связей пользователя с рецептом
+RECIPE_COUNTERS = {
+    Favorite: ("favorites_count", "popularity"),
+    ShoppingCart: ("in_carts_count",),
+}
+# Меньшая популярность после затухания считается нулевой
+MIN_POPULARITY = 0.01
+
+
+def change_counter(queryset, fields, delta):
+    """
+    Меняет счетчики (поле или кортеж полей) одним
+    UPDATE ... SET field = field + delta, чтобы
+    параллельные изменения не терялись. Вызывается в транзакции,
+    изменившей сами связи. Если счетчик уже разошелся со связями,
+    уменьшение останавливается на нуле до запуска reconcile_counters.
+    """
+    if isinstance(fields, str):
+        fields = (fields,)
+    if delta > 0:
+        queryset.update(**{field: F(field) + delta for field in fields})
+    elif delta < 0:
+        queryset.update(**{field: Greatest(F(field) + delta, 0) for field in fields})
+
+
+def get_favorite_weight(added_at, now):
+    """
+    Вклад добавления в избранное в популярность к моменту now: 1 в момент
+    добавления, затем убывает с периодом полураспада
+    POPULARITY_HALF_LIFE_DAYS, как при затухании командой decay_popularity.
+    """
+    half_life = settings.POPULARITY_HALF_LIFE_DAYS
+    if half_life <= 0:
+        return 1.0
+    days = max((now - added_at).total_seconds(), 0) / (24 * 60 * 60)
+    return 0.5 ** (days / half_life)
+
+
+def change_recipe_counters(model, recipe_ids, sign):
+    """
+    Меняет счетчики рецептов recipe_ids после добавления (sign=1)
+    или удаления (sign=-1) связей модели model. При удалении recipe_ids —
+    {id рецепта: время добавления связи}, как возвращает remove_recipes:
+    из популярности вычитается вклад добавления после затухания, а не 1,
+    иначе популярность остальных добавлений терялась бы.
+    """
+    if not recipe_ids:
+        return
+    recipes = Recipe.objects.filter(pk__in=list(recipe_ids))
+    if model is not Favorite or sign > 0:
+        change_counter(recipes, RECIPE_COUNTERS[model], sign)
+        return
+    now = timezone.now()
+    weight = Case(
+        *(
+            When(pk=recipe_id, then=Value(get_favorite_weight(added_at, now)))
+            for recipe_id, added_at in recipe_ids.items()
+        ),
+        output_field=FloatField(),
+    )
+    recipes.update(
+        favorites_count=Greatest(F("favorites_count") - 1, 0),
+        # Без добавлений в избранное популярность нулевая, а не остаток
+        # от неточности вычитания
+        popularity=Case(
+            When(favorites_count__lte=1, then=0.0),
+            default=Greatest(F("popularity") - weight, 0.0),
+        ),
+    )
+
+
+def delete_recipe(recipe):
+    """
+    Удаляет рецепт вместе с его вкладом в счетчик рецептов автора и списки
+    покупок пользователей. Используется API и admin.
+    """
+    with transaction.atomic(savepoint=False):
+        change_counter(User.objects.filter(pk=recipe.author_id), "recipes_count", -1)
+        change_recipes_in_shopping_lists(
+            [recipe.pk],
+            list(recipe.shopping_cart.values_list("user_id", flat=True)),
+            sign=-1,
+        )
+        recipe.delete()
+
+
+def count_related(related_model, related_field):
+    """Подзапрос с настоящим числом связей строки."""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{related_field: OuterRef("pk")})
+            .order_by()
+            .values(related_field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def reconcile_counter(
+    model, field, related_model, related_field, batch_size=1000, fix=True
+):
+    """
+    Сверяет счетчик с настоящим числом связей пачками по batch_size строк
+    в порядке первичного ключа и исправляет расхождения (если fix).
+    Возвращает id строк с расхождениями.
+    """
+    actual = count_related(related_model, related_field)
+    drifted = []
+    last_pk = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .annotate(actual=actual)
+            .values_list("pk", field, "actual")[:batch_size]
+        )
+        if not rows:
+            return drifted
+        last_pk = rows[-1][0]
+        stale = [pk for pk, value, expected in rows if value != expected]
+        if stale and fix:
+            # Пересчитываем в самом UPDATE, а не пишем прочитанные значения:
+            # связи могли измениться после чтения
+            with transaction.atomic():
+                model.objects.filter(pk__in=stale).update(**{field: actual})
+        drifted += stale
+
+
+def reconcile_counters(batch_size=1000, fix=True):
+    """Сверяет все счетчики. Возвращает {поле: id строк с расхождениями}."""
+    return {
+        field: reconcile_counter(
+            model, field, related_model, related_field, batch_size, fix
+        )
+        for model, field, related_model, related_field in COUNTERS
+    }
+
+
+def update_in_batches(queryset, batch_size, **values):
+    """
+    UPDATE строк queryset пачками по batch_size в порядке первичного ключа,
+    каждая пачка в своей транзакции, чтобы не держать блокировки на всей
+    таблице. Возвращает число измененных строк.
+    """
+    updated = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            queryset.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not pks:
+            return updated
+        last_pk = pks[-1]
+        with transaction.atomic():
+            updated += queryset.model.objects.filter(pk__in=pks).update(**values)
+
+
+def decay_popularity(factor, batch_size=1000):
+    """
+    Умножает популярность рецептов на factor (0 < factor < 1). Значения
+    меньше MIN_POPULARITY обнуляются, чтобы давно забытые рецепты
+    не участвовали в следующих затуханиях.
+    """
+    return update_in_batches(
+        Recipe.objects.filter(popularity__gt=0),
+        batch_size,
+        popularity=Case(
+            When(popularity__lt=MIN_POPULARITY / factor, then=0.0),
+            default=F("popularity") * factor,
+        ),
+    )
+
+
+def rebuild_popularity(batch_size=1000):
+    """Сбрасывает затухание: популярность становится равной favorites_count."""
+    return update_in_batches(
+        Recipe.objects.exclude(popularity=F("favorites_count")),
+        batch_size,
+        popularity=F("favorites_count"),
+    )
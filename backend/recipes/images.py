@@ -0,0 +1,154 @@
+import io
+import logging
+import posixpath
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .cache import invalidate_recipes
+from .models import Recipe, RecipeImageTask
+
+logger = logging.getLogger("foodgram.images")
+
+# Форматы уменьшенных копий: расширение -> (формат PIL, параметры сохранения)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Копия, которая отдается в поле image списков рецептов и кратких
+# представлений. JPEG открывается любым клиентом; WebP той же копии
+# доступен в image_variants
+LIST_IMAGE_VARIANT = ("small", "jpeg")
+VARIANTS_DIR = "recipes/variants"
+# Неудачные задачи повторяются, пока число попыток меньше MAX_ATTEMPTS
+MAX_ATTEMPTS = 3
+# Задача, взятая упавшим обработчиком, снова доступна через LEASE
+LEASE = timedelta(minutes=5)
+
+
+def get_variant_url(variants, variant=LIST_IMAGE_VARIANT):
+    """URL копии (размер, формат) из Recipe.image_variants или None."""
+    size, extension = variant
+    name = variants.get(size, {}).get(extension)
+    return default_storage.url(name) if name else None
+
+
+def make_variants(name, storage=default_storage):
+    """
+    Создает уменьшенные копии картинки name по settings.IMAGE_VARIANTS
+    во всех VARIANT_FORMATS. Картинка не увеличивается. Возвращает
+    {размер: {расширение: имя файла}}. Не обращается к БД, поэтому
+    выполняется в процессах пула.
+    """
+    with storage.open(name) as file:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    variants = {}
+    for size, max_side in settings.IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        variants[size] = {}
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            # JPEG не поддерживает прозрачность
+            converted = resized.convert("RGB") if image_format == "JPEG" else resized
+            buffer = io.BytesIO()
+            converted.save(buffer, image_format, **options)
+            variants[size][extension] = storage.save(
+                f"{VARIANTS_DIR}/{stem}_{size}.{extension}",
+                ContentFile(buffer.getvalue()),
+            )
+    return variants
+
+
+def enqueue_image_variants(recipe):
+    """
+    Ставит картинку рецепта в очередь на создание копий одним
+    INSERT ... ON CONFLICT DO UPDATE: у рецепта не больше одной задачи,
+    смена картинки перезапускает ее.
+    """
+    RecipeImageTask.objects.bulk_create(
+        [RecipeImageTask(recipe_id=recipe.pk, image=recipe.image.name)],
+        update_conflicts=True,
+        unique_fields=["recipe"],
+        update_fields=["image", "attempts", "locked_until"],
+    )
+
+
+def claim_image_tasks(limit):
+    """
+    Забирает до limit задач. SELECT ... FOR UPDATE SKIP LOCKED позволяет
+    запускать несколько обработчиков; взятые задачи помечаются
+    locked_until и до истечения LEASE другим не выдаются.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            RecipeImageTask.objects.select_for_update(skip_locked=True)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .filter(attempts__lt=MAX_ATTEMPTS)
+            .order_by("id")[:limit]
+        )
+        RecipeImageTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            locked_until=now + LEASE, attempts=F("attempts") + 1
+        )
+    return tasks
+
+
+def run_image_task(image):
+    """Выполняется в процессе пула: ошибки возвращаются, а не пробрасываются."""
+    try:
+        return make_variants(image), None
+    except Exception as error:  # noqa: BLE001 - любая ошибка PIL или хранилища
+        return None, f"{type(error).__name__}: {error}"
+
+
+def complete_image_task(task, variants):
+    """
+    Сохраняет копии, если картинка рецепта не сменилась за время обработки,
+    и удаляет задачу. Если сменилась, задача уже перезапущена для новой
+    картинки и остается в очереди.
+    """
+    recipes = Recipe.objects.filter(pk=task.recipe_id, image=task.image)
+    with transaction.atomic():
+        # Новый updated_at меняет ключ кэша представления во всех процессах
+        versions = list(recipes.values_list("id", "updated_at"))
+        recipes.update(image_variants=variants, updated_at=timezone.now())
+        RecipeImageTask.objects.filter(pk=task.pk, image=task.image).delete()
+    invalidate_recipes(versions)
+
+
+def process_image_tasks(pool=None, limit=10):
+    """
+    Обрабатывает одну пачку очереди в пуле процессов (или в текущем
+    процессе, если pool не задан). Возвращает число взятых задач.
+    """
+    tasks = claim_image_tasks(limit)
+    # Одна картинка у нескольких рецептов обрабатывается один раз
+    images = list(dict.fromkeys(task.image for task in tasks))
+    results = dict(
+        zip(
+            images,
+            pool.map(run_image_task, images) if pool else map(run_image_task, images),
+        )
+    )
+    for task in tasks:
+        variants, error = results[task.image]
+        if error is None:
+            complete_image_task(task, variants)
+        else:
+            logger.warning(
+                "Не удалось создать копии %s для рецепта %s (попытка %s): %s",
+                task.image,
+                task.recipe_id,
+                task.attempts + 1,
+                error,
+            )
+    return len(tasks)
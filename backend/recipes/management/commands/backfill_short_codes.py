@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from recipes.models import Recipe, make_short_code
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет коды коротких ссылок у рецептов, созданных до их "
+        "появления, пачками по --batch-size рецептов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        filled = 0
+        while True:
+            recipes = list(
+                Recipe.objects.filter(short_code__isnull=True)
+                .order_by("pk")
+                .only("pk")[: options["batch_size"]]
+            )
+            if not recipes:
+                break
+            for recipe in recipes:
+                recipe.short_code = make_short_code()
+            try:
+                with transaction.atomic():
+                    Recipe.objects.bulk_update(recipes, ["short_code"])
+            except IntegrityError:
+                # Совпадение кодов: пачка повторяется с новыми кодами
+                continue
+            filled += len(recipes)
+        self.stdout.write(self.style.SUCCESS(f"Заполнено кодов: {filled}"))
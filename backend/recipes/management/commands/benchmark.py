@@ -0,0 +1,213 @@
+import json
+import logging
+import platform
+import random
+import statistics
+import time
+from contextlib import ExitStack
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from foodgram_backend.middleware import QueryCounter
+from ingredients.models import Ingredient
+from recipes.management.dataset import seed_dataset
+from recipes.models import Favorite, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный бенчмарк основных эндпоинтов на синтетическом наборе "
+        "данных: p50/p95/p99 задержки и число запросов к БД на запрос."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--recipes", type=int, default=5000)
+        parser.add_argument("--ingredients-per-recipe", type=int, default=8)
+        parser.add_argument("--favorite-density", type=float, default=0.01)
+        parser.add_argument("--cart-density", type=float, default=0.002)
+        parser.add_argument("--subscription-density", type=float, default=0.05)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Запросов на эндпоинт, не меньше 2 для расчета перцентилей",
+        )
+        parser.add_argument(
+            "--cold-cache",
+            action="store_true",
+            help="Очищать кэш перед каждым запросом",
+        )
+        parser.add_argument(
+            "--output", help="Путь к JSON-файлу с результатами для сравнения"
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Не откатывать созданные данные после замеров",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 2:
+            raise CommandError("Для перцентилей нужно не меньше 2 запросов.")
+        if not Ingredient.objects.exists():
+            raise CommandError("Не найдены ингредиенты в базе. Сначала загрузите их.")
+        self.rng = random.Random(options["seed"])
+        self.options = options
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            users, self.recipe_ids = seed_dataset(
+                users=options["users"],
+                recipes=options["recipes"],
+                ingredients_per_recipe=options["ingredients_per_recipe"],
+                favorite_density=options["favorite_density"],
+                cart_density=options["cart_density"],
+                subscription_density=options["subscription_density"],
+                seed=options["seed"],
+                prefix="benchmark",
+            )
+            self.stdout.write(
+                f"Набор данных создан за {time.perf_counter() - started:.1f} с"
+            )
+            self.user = users[0]
+            self.client = APIClient(HTTP_HOST="localhost")
+            token = Token.objects.create(user=self.user)
+            self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+            # Превышения бюджетов запросов и так видны в отчете
+            logging.getLogger("foodgram.queries").setLevel(logging.ERROR)
+            results = {
+                name: self.measure(scenario)
+                for name, scenario in self.get_scenarios().items()
+            }
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+        self.report(results)
+
+    def get_scenarios(self):
+        """Сценарий - функция, возвращающая (метод, путь) очередного запроса."""
+        names = list(Ingredient.objects.values_list("name", flat=True)[:500])
+        pages = max(len(self.recipe_ids) // 6, 1)
+        rng = self.rng
+
+        def toggle(action, model):
+            state = {}
+            taken = set(
+                model.objects.filter(user=self.user).values_list("recipe_id", flat=True)
+            )
+            free_ids = [
+                recipe_id for recipe_id in self.recipe_ids if recipe_id not in taken
+            ]
+
+            def scenario():
+                # Чередуем добавление и удаление одного и того же рецепта
+                if state.get("recipe_id") is None:
+                    state["recipe_id"] = rng.choice(free_ids)
+                    return "post", f"/api/recipes/{state['recipe_id']}/{action}/"
+                recipe_id, state["recipe_id"] = state["recipe_id"], None
+                return "delete", f"/api/recipes/{recipe_id}/{action}/"
+
+            return scenario
+
+        return {
+            "recipe-list": lambda: (
+                "get",
+                f"/api/recipes/?page={rng.randint(1, min(pages, 50))}",
+            ),
+            "recipe-list-cursor": lambda: ("get", "/api/recipes/?pagination=cursor"),
+            "recipe-popular": lambda: ("get", "/api/recipes/popular/"),
+            "recipe-detail": lambda: (
+                "get",
+                f"/api/recipes/{rng.choice(self.recipe_ids)}/",
+            ),
+            "ingredient-autocomplete": lambda: (
+                "get",
+                f"/api/ingredients/?name={rng.choice(names)[:2]}",
+            ),
+            "subscription-list": lambda: (
+                "get",
+                "/api/users/subscriptions/?recipes_limit=3",
+            ),
+            "download-shopping-cart": lambda: (
+                "get",
+                "/api/recipes/download_shopping_cart/",
+            ),
+            "favorite-toggle": toggle("favorite", Favorite),
+            "shopping-cart-toggle": toggle("shopping_cart", ShoppingCart),
+        }
+
+    def measure(self, scenario):
+        timings, queries, statuses = [], [], {}
+        for _ in range(self.options["requests"]):
+            if self.options["cold_cache"]:
+                cache.clear()
+            method, path = scenario()
+            counter = QueryCounter()
+            with ExitStack() as stack:
+                for db in connections.all():
+                    stack.enter_context(db.execute_wrapper(counter))
+                started = time.perf_counter()
+                response = getattr(self.client, method)(path)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+        return {
+            "requests": len(timings),
+            "status_codes": statuses,
+            "mean_ms": round(statistics.fmean(timings), 3),
+            "p50_ms": round(percentiles[49], 3),
+            "p95_ms": round(percentiles[94], 3),
+            "p99_ms": round(percentiles[98], 3),
+            "queries_mean": round(statistics.fmean(queries), 2),
+            "queries_max": max(queries),
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'эндпоинт':<26}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"
+            f"{'запросов':>10}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<26}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['queries_mean']:>10.1f}"
+            )
+        if self.options["output"]:
+            parameters = {
+                key: self.options[key]
+                for key in (
+                    "users",
+                    "recipes",
+                    "ingredients_per_recipe",
+                    "favorite_density",
+                    "cart_density",
+                    "subscription_density",
+                    "seed",
+                    "requests",
+                    "cold_cache",
+                )
+            }
+            with open(self.options["output"], "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "created_at": timezone.now().isoformat(),
+                        "database": connection.vendor,
+                        "python": platform.python_version(),
+                        "parameters": parameters,
+                        "results": results,
+                    },
+                    file,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            self.stdout.write(
+                self.style.SUCCESS(f"Результаты записаны в {self.options['output']}")
+            )
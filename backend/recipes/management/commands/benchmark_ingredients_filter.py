@@ -0,0 +1,119 @@
+import random
+import statistics
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from recipes.models import Recipe, RecipeIngredient
+from ingredients.models import Ingredient
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет список рецептов с фильтром по ингредиентам (?ingredients=) "
+        "на синтетических данных. Данные создаются в транзакции и откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--per-recipe", type=int, default=10)
+        parser.add_argument("--filter-size", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list("id", flat=True))
+        if len(ingredient_ids) < options["per_recipe"]:
+            raise CommandError("Не хватает ингредиентов в базе. Сначала загрузите их.")
+        rng = random.Random(options["seed"])
+
+        with transaction.atomic():
+            self.seed(rng, ingredient_ids, options)
+            for match_all in (True, False):
+                self.measure(rng, ingredient_ids, match_all, options)
+            transaction.set_rollback(True)
+
+    def seed(self, rng, ingredient_ids, options):
+        per_recipe = options["per_recipe"]
+        batch_size = options["batch_size"]
+        recipes_count = options["rows"] // per_recipe
+        author = User.objects.create_user(
+            username="benchmark_author", email="benchmark_author@example.com"
+        )
+        self.stdout.write(
+            f"Создание {recipes_count} рецептов и "
+            f"{recipes_count * per_recipe} ингредиентов в рецептах..."
+        )
+        started = time.perf_counter()
+        for offset in range(0, recipes_count, batch_size):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    author=author,
+                    name=f"Рецепт {number}",
+                    text="Описание",
+                    image="recipes/benchmark.jpg",
+                    cooking_time=10,
+                )
+                for number in range(offset, min(offset + batch_size, recipes_count))
+            )
+            RecipeIngredient.objects.bulk_create(
+                (
+                    RecipeIngredient(
+                        recipe=recipe, ingredient_id=ingredient_id, amount=1
+                    )
+                    for recipe in recipes
+                    for ingredient_id in rng.sample(ingredient_ids, per_recipe)
+                ),
+                batch_size=batch_size,
+            )
+        self.stdout.write(f"Данные созданы за {time.perf_counter() - started:.1f} с")
+
+    def measure(self, rng, ingredient_ids, match_all, options):
+        """
+        Замеряет запросы GET /api/recipes/?ingredients= через тестовый
+        клиент: тот же queryset, пагинацию и сериализацию, что у API.
+        """
+        client = APIClient(HTTP_HOST="localhost")
+        mode = "all" if match_all else "any"
+        timings, queries, found = [], [], 0
+        for _ in range(options["repeat"]):
+            ids = ",".join(
+                str(ingredient_id)
+                for ingredient_id in rng.sample(ingredient_ids, options["filter_size"])
+            )
+            path = f"/api/recipes/?ingredients={ids}&ingredients_match={mode}&limit=6"
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(path)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f"{path}: ответ {response.status_code}")
+            found += len(response.data["results"])
+            queries.append([query["sql"] for query in context.captured_queries])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"ingredients_match={mode}: медиана {statistics.median(timings):.2f} мс, "
+                f"максимум {max(timings):.2f} мс, запросов к БД "
+                f"{statistics.fmean(len(sqls) for sqls in queries):.1f}, найдено "
+                f"в среднем {found / options['repeat']:.1f} рецептов на странице"
+            )
+        )
+        # Планы запросов с фильтром из последнего ответа: COUNT(*) и страница
+        quote_name = connection.ops.quote_name
+        recipes_from = f"FROM {quote_name(Recipe._meta.db_table)} "
+        ingredients_table = quote_name(RecipeIngredient._meta.db_table)
+        with connection.cursor() as cursor:
+            # Запросы записаны с подставленными параметрами
+            for sql in queries[-1]:
+                if recipes_from not in sql or ingredients_table not in sql:
+                    continue
+                cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+                self.stdout.write(sql)
+                self.stdout.write(
+                    "\n".join(" ".join(map(str, row)) for row in cursor.fetchall())
+                )
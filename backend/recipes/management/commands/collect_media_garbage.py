@@ -0,0 +1,82 @@
+import os
+import time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe, RecipeImageTask
+from recipes.uploads import purge_uploads
+from users.models import User
+
+
+def get_referenced_files():
+    """Имена всех файлов, на которые ссылаются записи в БД."""
+    names = set(Recipe.objects.values_list("image", flat=True).distinct().order_by())
+    for variants in (
+        Recipe.objects.values_list("image_variants", flat=True)
+        .distinct()
+        .order_by()
+        .iterator()
+    ):
+        names.update(name for formats in variants.values() for name in formats.values())
+    names.update(RecipeImageTask.objects.values_list("image", flat=True))
+    names.update(User.objects.values_list("avatar", flat=True).distinct().order_by())
+    names.discard(None)
+    names.discard("")
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет из MEDIA_ROOT картинки, на которые не ссылается ни один "
+        "рецепт, копия картинки, задача обработки или аватар, и "
+        "заброшенные загрузки картинок по частям."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--directories",
+            nargs="+",
+            default=["recipes", "users"],
+            help="Каталоги MEDIA_ROOT, в которых ищутся неиспользуемые файлы",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=float,
+            default=24,
+            help="Не трогать файлы моложе стольких часов: запись, которая "
+            "на них ссылается, может быть еще не сохранена, а загрузка "
+            "по частям может продолжиться",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, что будет удалено",
+        )
+
+    def handle(self, *args, **options):
+        referenced = get_referenced_files()
+        oldest = time.time() - options["min_age"] * 3600
+        removed = freed = 0
+        for directory in options["directories"]:
+            root = default_storage.path(directory)
+            for path, _, files in os.walk(root):
+                for file_name in files:
+                    full_path = os.path.join(path, file_name)
+                    name = os.path.relpath(full_path, default_storage.location)
+                    name = name.replace(os.sep, "/")
+                    stat = os.stat(full_path)
+                    if name in referenced or stat.st_mtime > oldest:
+                        continue
+                    if options["verbosity"] > 1:
+                        self.stdout.write(name)
+                    if not options["dry_run"]:
+                        os.remove(full_path)
+                    removed += 1
+                    freed += stat.st_size
+        uploads = purge_uploads(options["min_age"] * 3600, options["dry_run"])
+        action = "Будет удалено" if options["dry_run"] else "Удалено"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} файлов: {removed}, {freed / 1024 / 1024:.1f} МБ, "
+                f"загрузок: {uploads}"
+            )
+        )
@@ -1,20 +1,57 @@
-import random
-import io
+import os
+import time
 from django.core.management.base import BaseCommand
-from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
-from recipes.models import Recipe, RecipeIngredient
+from django.db import connection
+from recipes.management.dataset import DATASET_PASSWORD, seed_dataset
 from ingredients.models import Ingredient
-from PIL import Image
 
 User = get_user_model()
 
 
 class Command(BaseCommand):
-    help = "Создает тестовых пользователей и рецепты"
+    help = (
+        "Создает тестовых пользователей, рецепты, избранное, списки покупок "
+        "и подписки. Объем задается параметрами, вставка идет пачками."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5)
+        parser.add_argument("--recipes", type=int, default=5)
+        parser.add_argument("--ingredients-per-recipe", type=int, default=5)
+        parser.add_argument(
+            "--favorite-density",
+            type=float,
+            default=0.2,
+            help="Доля рецептов в избранном у каждого пользователя",
+        )
+        parser.add_argument(
+            "--cart-density",
+            type=float,
+            default=0.2,
+            help="Доля рецептов в списке покупок у каждого пользователя",
+        )
+        parser.add_argument(
+            "--subscription-density",
+            type=float,
+            default=0.2,
+            help="Доля авторов, на которых подписан каждый пользователь",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Число процессов для вставки рецептов и связей",
+        )
+        parser.add_argument(
+            "--prefix", default="test", help="Префикс имен тестовых пользователей"
+        )
 
-    def handle(self, *args, **kwargs):
-        if Recipe.objects.filter(author__username__startswith="test_user").exists():
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=f"{prefix}_user").exists():
             self.stdout.write(
                 self.style.WARNING(
                     "Тестовые данные уже существуют. Пропускаем создание."
@@ -22,104 +59,49 @@ class Command(BaseCommand):
             )
             return
 
-        self.stdout.write("Создание тестовых пользователей...")
-
-        users = []
-        for i in range(1, 6):
-            user, created = User.objects.get_or_create(
-                username=f"user{i}",
-                defaults={
-                    "email": f"test{i}@example.com",
-                    "first_name": f"имя{i}",
-                    "last_name": f"фамилия{i}",
-                },
-            )
-            if created:
-                user.set_password("password123")
-                user.save()
-                self.stdout.write(f"Создан пользователь {user.username}")
-            users.append(user)
-
-        ingredients = list(Ingredient.objects.all())
-        if not ingredients:
+        if not Ingredient.objects.exists():
             self.stdout.write(
                 self.style.ERROR("Не найдены ингредиенты в базе. Сначала загрузите их.")
             )
             return
 
-        self.stdout.write("Создание тестовых рецептов...")
-
-        recipe_templates = [
-            {
-                "name": "Омлет с помидорами",
-                "text": "Взбейте яйца, добавьте соль и перец. Нарежьте помидоры кубиками. Обжарьте на сковороде, залейте яйцами и готовьте до золотистой корочки.",
-                "cooking_time": 15,
-                "color": (255, 200, 100),  # Цвет для генерации изображения
-            },
-            {
-                "name": 'Салат "Цезарь"',
-                "text": "Нарежьте салат, курицу и помидоры. Добавьте сухарики и заправьте специальным соусом.",
-                "cooking_time": 20,
-                "color": (100, 200, 100),
-            },
-            {
-                "name": "Паста карбонара",
-                "text": "Отварите макароны. Обжарьте бекон, смешайте с яйцом и сыром. Добавьте к макаронам и перемешайте.",
-                "cooking_time": 25,
-                "color": (220, 180, 140),
-            },
-            {
-                "name": "Тирамису",
-                "text": "Смешайте маскарпоне с яйцами и сахаром. Пропитайте печенье кофе и ликером. Выложите слоями в форму.",
-                "cooking_time": 240,
-                "color": (160, 120, 90),
-            },
-            {
-                "name": "Овощное рагу",
-                "text": "Нарежьте овощи, обжарьте на оливковом масле, добавьте специи и томите до готовности.",
-                "cooking_time": 45,
-                "color": (120, 180, 70),
-            },
-        ]
-
-        def create_test_image(color):
-            image = Image.new("RGB", (300, 200), color=color)
-            image_io = io.BytesIO()
-            image.save(image_io, format="JPEG")
-            image_file = SimpleUploadedFile(
-                name=f"test_image_{color[0]}_{color[1]}_{color[2]}.jpg",
-                content=image_io.getvalue(),
-                content_type="image/jpeg",
-            )
-            return image_file
-
-        for i, user in enumerate(users):
-            template = recipe_templates[i % len(recipe_templates)]
-
-            test_image = create_test_image(template["color"])
-
-            recipe = Recipe.objects.create(
-                author=user,
-                name=template["name"],
-                text=template["text"],
-                cooking_time=template["cooking_time"],
-                image=test_image,
-            )
-
-            selected_ingredients = random.sample(
-                ingredients, random.randint(3, min(6, len(ingredients)))
-            )
-            for ingredient in selected_ingredients:
-                RecipeIngredient.objects.create(
-                    recipe=recipe, ingredient=ingredient, amount=random.randint(1, 500)
-                )
-
-            self.stdout.write(
-                f'Создан рецепт "{recipe.name}" для пользователя {user.username}'
-            )
-
+        workers = options["workers"]
+        if connection.vendor == "sqlite" and workers > 1:
+            # SQLite не допускает параллельной записи из нескольких процессов
+            self.stdout.write("SQLite: данные создаются в одном процессе")
+            workers = 1
+
+        self.started = time.perf_counter()
+        self.reported = {}
+        users, recipe_ids = seed_dataset(
+            users=options["users"],
+            recipes=options["recipes"],
+            ingredients_per_recipe=options["ingredients_per_recipe"],
+            favorite_density=options["favorite_density"],
+            cart_density=options["cart_density"],
+            subscription_density=options["subscription_density"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            prefix=prefix,
+            workers=workers,
+            progress=self.progress,
+        )
         self.stdout.write(
             self.style.SUCCESS(
-                f"Успешно создано {len(users)} тестовых пользователей и {len(users)} рецептов"
+                f"Успешно создано {len(users)} тестовых пользователей и "
+                f"{len(recipe_ids)} рецептов за "
+                f"{time.perf_counter() - self.started:.1f} с. "
+                f"Пароль пользователей: {DATASET_PASSWORD}"
             )
         )
+
+    def progress(self, stage, done, total):
+        # Не чаще раза в секунду на этап, но последнюю пачку показываем всегда
+        now = time.perf_counter()
+        if done < total and now - self.reported.get(stage, 0) < 1:
+            return
+        self.reported[stage] = now
+        percent = done * 100 // total if total else 100
+        self.stdout.write(
+            f"[{now - self.started:7.1f} с] {stage}: {done}/{total} ({percent}%)"
+        )
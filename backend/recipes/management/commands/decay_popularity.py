@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes.counters import decay_popularity, rebuild_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Затухание популярности рецептов: умножает ее на 0.5 ** (hours / "
+        "период полураспада). Запускается по расписанию раз в --hours часов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=24,
+            help="Сколько часов прошло с прошлого запуска",
+        )
+        parser.add_argument(
+            "--half-life-days",
+            type=float,
+            default=settings.POPULARITY_HALF_LIFE_DAYS,
+            help="Период полураспада в днях, 0 отключает затухание",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Сбросить затухание: популярность равна числу добавлений в избранное",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            count = rebuild_popularity(options["batch_size"])
+            self.stdout.write(
+                self.style.SUCCESS(f"Популярность пересчитана у {count} рецептов")
+            )
+            return
+        half_life = options["half_life_days"]
+        if half_life <= 0:
+            self.stdout.write("Затухание отключено")
+            return
+        if options["hours"] <= 0:
+            raise CommandError("--hours должно быть положительным")
+        factor = 0.5 ** (options["hours"] / (half_life * 24))
+        count = decay_popularity(factor, options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Популярность {count} рецептов умножена на {factor:.4f}"
+            )
+        )
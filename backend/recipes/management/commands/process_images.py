@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from recipes.images import process_image_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Обработчик очереди картинок рецептов: создает уменьшенные копии "
+        "в пуле процессов. Без --once работает, пока его не остановят."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Число процессов, обрабатывающих картинки",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=20, help="Задач за одну выборку"
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2,
+            help="Пауза в секундах, когда очередь пуста",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать очередь и завершиться",
+        )
+
+    def handle(self, *args, **options):
+        pool = None
+        if options["workers"] > 1:
+            # Процессы пула работают только с файлами, соединения с БД
+            # остаются у родителя; fork не должен их копировать
+            connections.close_all()
+            pool = multiprocessing.get_context("fork").Pool(options["workers"])
+        processed = 0
+        try:
+            while True:
+                count = process_image_tasks(pool, options["batch_size"])
+                processed += count
+                if count:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write(self.style.SUCCESS(f"Обработано задач: {processed}"))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import get_shopping_list_totals, rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает суммы ингредиентов в списках покупок (ShoppingListItem) "
+        "по рецептам из корзин пользователей."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            nargs="+",
+            help="Id пользователей; по умолчанию пересобираются все списки",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только найти пользователей с расхождениями, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options["users"]
+        if options["check"]:
+            stale = self.find_stale_users(user_ids)
+            if stale:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"Расхождения у {len(stale)} пользователей: "
+                        + " ".join(map(str, sorted(stale)[:50]))
+                    )
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS("Списки покупок актуальны"))
+            return
+
+        count = rebuild_shopping_lists(user_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f"Списки покупок пересобраны: {count} позиций")
+        )
+
+    def find_stale_users(self, user_ids=None):
+        expected = {
+            (total["recipe__shopping_cart__user"], total["ingredient"]): total[
+                "total_amount"
+            ]
+            for total in get_shopping_list_totals(user_ids).iterator()
+        }
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        stale = set()
+        for user_id, ingredient_id, total_amount in items.values_list(
+            "user_id", "ingredient_id", "total_amount"
+        ).iterator():
+            if expected.pop((user_id, ingredient_id), None) != total_amount:
+                stale.add(user_id)
+        # Оставшиеся суммы отсутствуют в ShoppingListItem
+        stale.update(user_id for user_id, _ in expected)
+        return stale
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет счетчики избранного, списков покупок, рецептов и подписчиков "
+        "с настоящим числом связей и исправляет расхождения пачками."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только найти расхождения, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        drifted = reconcile_counters(
+            batch_size=options["batch_size"], fix=not options["check"]
+        )
+        for field, ids in drifted.items():
+            if not ids:
+                self.stdout.write(self.style.SUCCESS(f"{field}: расхождений нет"))
+                continue
+            action = "найдены" if options["check"] else "исправлены"
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{field}: {action} расхождения у {len(ids)} строк: "
+                    + " ".join(map(str, ids[:50]))
+                )
+            )
@@ -0,0 +1,297 @@
+import io
+import multiprocessing
+import random
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, connections
+from django.utils import timezone
+from PIL import Image
+from recipes.models import Recipe, RecipeIngredient, Favorite, ShoppingCart
+from recipes.counters import rebuild_popularity, reconcile_counters
+from recipes.images import make_variants
+from recipes.shopping_list import rebuild_shopping_lists
+from users.models import Subscription
+from ingredients.models import Ingredient
+
+User = get_user_model()
+
+DATASET_PASSWORD = "password123"
+DATASET_IMAGE = "recipes/dataset.jpg"
+
+RECIPE_TEMPLATES = [
+    {
+        "name": "Омлет с помидорами",
+        "text": "Взбейте яйца, добавьте соль и перец. Нарежьте помидоры кубиками. Обжарьте на сковороде, залейте яйцами и готовьте до золотистой корочки.",
+        "cooking_time": 15,
+    },
+    {
+        "name": 'Салат "Цезарь"',
+        "text": "Нарежьте салат, курицу и помидоры. Добавьте сухарики и заправьте специальным соусом.",
+        "cooking_time": 20,
+    },
+    {
+        "name": "Паста карбонара",
+        "text": "Отварите макароны. Обжарьте бекон, смешайте с яйцом и сыром. Добавьте к макаронам и перемешайте.",
+        "cooking_time": 25,
+    },
+    {
+        "name": "Тирамису",
+        "text": "Смешайте маскарпоне с яйцами и сахаром. Пропитайте печенье кофе и ликером. Выложите слоями в форму.",
+        "cooking_time": 240,
+    },
+    {
+        "name": "Овощное рагу",
+        "text": "Нарежьте овощи, обжарьте на оливковом масле, добавьте специи и томите до готовности.",
+        "cooking_time": 45,
+    },
+]
+
+# Параметры пачек, общие для всех процессов. Заполняются перед запуском
+# пачек в текущем процессе или в init_worker у дочерних.
+_params = {}
+
+
+def get_dataset_image():
+    """
+    Одна картинка на весь набор данных. Хранилище именует файлы
+    по содержимому, поэтому повторные запуски не создают копий.
+    """
+    image_io = io.BytesIO()
+    Image.new("RGB", (300, 200), color=(220, 180, 140)).save(image_io, format="JPEG")
+    return default_storage.save(DATASET_IMAGE, ContentFile(image_io.getvalue()))
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def get_rng(stage, start):
+    # Генератор зависит только от seed и пачки, а не от процесса,
+    # который ее обработал, поэтому содержимое данных воспроизводимо.
+    return random.Random(f"{_params['seed']}:{stage}:{start}")
+
+
+def insert_rows(model, fields, rows):
+    """
+    Вставляет строки связующей таблицы: на PostgreSQL одним COPY,
+    на остальных БД через bulk_create. Возвращает число строк.
+    """
+    rows = list(rows)
+    if connection.vendor != "postgresql":
+        model.objects.bulk_create(
+            (model(**dict(zip(fields, row))) for row in rows),
+            batch_size=_params["batch_size"],
+        )
+        return len(rows)
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(
+        quote_name(model._meta.get_field(field).column) for field in fields
+    )
+    # Значения - целые числа и даты, экранирование формата COPY не нужно
+    data = io.StringIO("".join("\t".join(map(str, row)) + "\n" for row in rows))
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f"COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN", data
+        )
+    return len(rows)
+
+
+def make_recipe(number):
+    author_ids = _params["author_ids"]
+    template = RECIPE_TEMPLATES[number % len(RECIPE_TEMPLATES)]
+    return Recipe(
+        author_id=author_ids[number % len(author_ids)],
+        name=f"{template['name']} {number}",
+        text=template["text"],
+        image=_params["image"],
+        image_variants=_params["image_variants"],
+        cooking_time=template["cooking_time"],
+    )
+
+
+def seed_recipes(start, stop):
+    """Создает рецепты с номерами [start, stop) и их ингредиенты."""
+    rng = get_rng("recipes", start)
+    recipes = Recipe.objects.bulk_create(
+        make_recipe(number) for number in range(start, stop)
+    )
+    insert_rows(
+        RecipeIngredient,
+        ("recipe_id", "ingredient_id", "amount"),
+        (
+            (recipe.pk, ingredient_id, rng.randint(1, 500))
+            for recipe in recipes
+            for ingredient_id in rng.sample(
+                _params["ingredient_ids"], _params["ingredients_per_recipe"]
+            )
+        ),
+    )
+    return [recipe.pk for recipe in recipes]
+
+
+def seed_user_recipes(start, stop):
+    """Добавляет рецепты в избранное и корзину пользователям [start, stop)."""
+    rng = get_rng("relations", start)
+    recipe_ids = _params["recipe_ids"]
+    created_at = timezone.now()
+    count = 0
+    for model, per_user in (
+        (Favorite, _params["favorites_per_user"]),
+        (ShoppingCart, _params["carts_per_user"]),
+    ):
+        count += insert_rows(
+            model,
+            ("user_id", "recipe_id", "created_at"),
+            (
+                (user_id, recipe_id, created_at)
+                for user_id in _params["author_ids"][start:stop]
+                for recipe_id in rng.sample(recipe_ids, per_user)
+            ),
+        )
+    return count
+
+
+def init_worker(params):
+    _params.update(params)
+
+
+def run_chunk(task):
+    function, start, stop = task
+    return function(start, stop)
+
+
+def run_chunks(function, total, chunk_size, workers, progress, stage):
+    """
+    Выполняет function(start, stop) по пачкам в workers процессах и
+    возвращает результаты в порядке пачек.
+    """
+    tasks = [
+        (function, start, min(start + chunk_size, total))
+        for start in range(0, total, chunk_size)
+    ]
+    results, done = {}, 0
+    if workers > 1 and len(tasks) > 1:
+        # Дочерние процессы должны открыть свои соединения с БД, а не
+        # пользоваться унаследованными. fork нужен, чтобы не настраивать
+        # Django в каждом процессе заново.
+        connections.close_all()
+        pool = multiprocessing.get_context("fork").Pool(
+            workers, initializer=init_worker, initargs=(_params,)
+        )
+        with pool:
+            for (_, start, stop), result in zip(tasks, pool.imap(run_chunk, tasks)):
+                results[start] = result
+                done += stop - start
+                progress(stage, done, total)
+    else:
+        for task in tasks:
+            _, start, stop = task
+            results[start] = run_chunk(task)
+            done += stop - start
+            progress(stage, done, total)
+    return [results[start] for _, start, _ in tasks]
+
+
+def seed_dataset(
+    users=100,
+    recipes=1000,
+    ingredients_per_recipe=8,
+    favorite_density=0.01,
+    cart_density=0.005,
+    subscription_density=0.05,
+    seed=42,
+    batch_size=5000,
+    prefix="dataset",
+    workers=1,
+    progress=None,
+):
+    """
+    Создает воспроизводимый синтетический набор данных.
+
+    Плотности задают долю от возможных связей: favorite_density=0.01 значит,
+    что каждый пользователь добавил в избранное 1% всех рецептов.
+    Рецепты и связи создаются пачками по batch_size в workers процессах;
+    при workers > 1 вставки идут вне текущей транзакции.
+    progress(этап, сделано, всего) вызывается после каждой пачки.
+    Возвращает список созданных пользователей и id рецептов.
+    """
+    progress = progress or (lambda stage, done, total: None)
+    ingredient_ids = list(Ingredient.objects.values_list("id", flat=True))
+    if len(ingredient_ids) < ingredients_per_recipe:
+        raise ValueError("Не хватает ингредиентов в базе. Сначала загрузите их.")
+
+    password = make_password(DATASET_PASSWORD)
+    created_users = []
+    for numbers in batched(range(users), batch_size):
+        created_users += User.objects.bulk_create(
+            User(
+                username=f"{prefix}_user{number}",
+                email=f"{prefix}_user{number}@example.com",
+                first_name=f"имя{number}",
+                last_name=f"фамилия{number}",
+                password=password,
+            )
+            for number in numbers
+        )
+        progress("users", len(created_users), users)
+
+    image = get_dataset_image()
+    _params.clear()
+    _params.update(
+        seed=seed,
+        batch_size=batch_size,
+        image=image,
+        image_variants=make_variants(image),
+        author_ids=[user.pk for user in created_users],
+        ingredient_ids=ingredient_ids,
+        ingredients_per_recipe=ingredients_per_recipe,
+    )
+    recipe_ids = [
+        recipe_id
+        for chunk in run_chunks(
+            seed_recipes, recipes, batch_size, workers, progress, "recipes"
+        )
+        for recipe_id in chunk
+    ]
+
+    _params.update(
+        recipe_ids=recipe_ids,
+        favorites_per_user=min(round(favorite_density * recipes), recipes),
+        carts_per_user=min(round(cart_density * recipes), recipes),
+    )
+    per_user = _params["favorites_per_user"] + _params["carts_per_user"]
+    run_chunks(
+        seed_user_recipes,
+        users,
+        max(batch_size // max(per_user, 1), 1),
+        workers,
+        progress,
+        "favorites",
+    )
+
+    for user_ids in batched(_params["author_ids"], 1000):
+        rebuild_shopping_lists(user_ids)
+    progress("shopping lists", users, users)
+
+    per_user = min(round(subscription_density * users), max(users - 1, 0))
+    # Выбираем из остальных пользователей: индексы после своего сдвигаются на 1
+    rng = get_rng("subscriptions", 0)
+    insert_rows(
+        Subscription,
+        ("user_id", "subscriber_id"),
+        (
+            (user.pk, created_users[index + (index >= position)].pk)
+            for position, user in enumerate(created_users)
+            for index in rng.sample(range(users - 1), per_user)
+        ),
+    )
+    progress("subscriptions", users, users)
+
+    # Связи вставлены напрямую, минуя обновление счетчиков
+    reconcile_counters(batch_size=batch_size)
+    rebuild_popularity(batch_size=batch_size)
+    progress("counters", users, users)
+    return created_users, recipe_ids
@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+def copy_created_at(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Recipe.objects.update(updated_at=models.F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0006_recipe_keyset_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, verbose_name="Дата изменения"),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 17:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ingredients", "0001_initial"),
+        ("recipes", "0008_recipe_search_vector"),
+    ]
+
+    operations = [
+        # Сначала создаем составной индекс, затем убираем индекс внешнего ключа
+        migrations.AddIndex(
+            model_name="recipeingredient",
+            index=models.Index(
+                fields=["ingredient", "recipe"], name="recipe_ingredient_lookup_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipeingredient",
+            name="ingredient",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="ingredients.ingredient",
+                verbose_name="Ингредиент",
+            ),
+        ),
+    ]
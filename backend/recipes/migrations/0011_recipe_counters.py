@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 18:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ("recipes", "Recipe", "favorites_count", "recipes", "Favorite", "recipe"),
+    ("recipes", "Recipe", "in_carts_count", "recipes", "ShoppingCart", "recipe"),
+    ("users", "User", "recipes_count", "recipes", "Recipe", "author"),
+    ("users", "User", "subscribers_count", "users", "Subscription", "subscriber"),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for app, model, field, related_app, related_model, related_field in COUNTERS:
+        related = apps.get_model(related_app, related_model)
+        actual = Subquery(
+            related.objects.filter(**{related_field: OuterRef("pk")})
+            .order_by()
+            .values(related_field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        apps.get_model(app, model).objects.update(**{field: Coalesce(actual, 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0010_shopping_list_item"),
+        ("users", "0003_user_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="favorites_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="В избранном"
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="in_carts_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="В списках покупок"
+            ),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+def fill_popularity(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Recipe.objects.filter(favorites_count__gt=0).update(
+        popularity=models.F("favorites_count")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0011_recipe_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="popularity",
+            field=models.FloatField(
+                default=0, editable=False, verbose_name="Популярность"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["-popularity", "-id"], name="recipe_popularity_id_idx"
+            ),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2 on 2026-10-18 18:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def enqueue_existing_images(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    RecipeImageTask = apps.get_model("recipes", "RecipeImageTask")
+    RecipeImageTask.objects.bulk_create(
+        (
+            RecipeImageTask(recipe_id=recipe_id, image=image)
+            for recipe_id, image in Recipe.objects.exclude(image="")
+            .values_list("id", "image")
+            .iterator()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0012_recipe_popularity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="image_variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Копии картинки"
+            ),
+        ),
+        migrations.CreateModel(
+            name="RecipeImageTask",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("image", models.CharField(max_length=255, verbose_name="Картинка")),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(default=0, verbose_name="Попытки"),
+                ),
+                (
+                    "locked_until",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Занята до"
+                    ),
+                ),
+                (
+                    "recipe",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_task",
+                        to="recipes.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Обработка картинки",
+                "verbose_name_plural": "Обработка картинок",
+            },
+        ),
+        migrations.RunPython(enqueue_existing_images, migrations.RunPython.noop),
+    ]
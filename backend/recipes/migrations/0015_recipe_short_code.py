@@ -0,0 +1,38 @@
+from django.db import migrations, models
+import recipes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0014_image_upload"),
+    ]
+
+    # Поле добавляется без значения по умолчанию, чтобы существующие
+    # рецепты не получили один общий код: их коды заполняет команда
+    # backfill_short_codes
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="short_code",
+            field=models.CharField(
+                editable=False,
+                max_length=8,
+                null=True,
+                unique=True,
+                verbose_name="Код короткой ссылки",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="short_code",
+            field=models.CharField(
+                default=recipes.models.make_short_code,
+                editable=False,
+                max_length=8,
+                null=True,
+                unique=True,
+                verbose_name="Код короткой ссылки",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0015_recipe_short_code"),
+    ]
+
+    # Существующие связи получают время применения миграции: их вклад
+    # в популярность считается от него
+    operations = [
+        migrations.AddField(
+            model_name="favorite",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="Дата добавления",
+            ),
+        ),
+        migrations.AddField(
+            model_name="shoppingcart",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="Дата добавления",
+            ),
+        ),
+    ]
@@ -1,6 +1,23 @@
-from django.db import models
+import datetime
+import secrets
+import string
+import uuid
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connections, models
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Value,
+    When,
+)
 from django.core.validators import MinValueValidator, MaxValueValidator
-from users.models import User
+from django.utils import timezone
+from users.models import User, Subscription
 from ingredients.models import Ingredient
 
 # Константы для избегания "magic numbers"
@@ -9,6 +26,96 @@ MAX_COOKING_TIME = 32000
 MIN_AMOUNT = 1
 MAX_AMOUNT = 32000
 
+# Короткие ссылки /s/<код>: случайные коды base62. При 62^8 вариантах
+# совпадение кодов практически исключено
+SHORT_CODE_ALPHABET = string.digits + string.ascii_letters
+SHORT_CODE_LENGTH = 8
+
+
+def make_short_code():
+    return "".join(
+        secrets.choice(SHORT_CODE_ALPHABET) for _ in range(SHORT_CODE_LENGTH)
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Подгружает автора и ингредиенты рецептов фиксированным числом запросов."""
+        return (
+            self.select_related("author")
+            .defer("search_vector")
+            .prefetch_related(
+                Prefetch(
+                    "recipe_ingredients",
+                    queryset=RecipeIngredient.objects.select_related("ingredient"),
+                )
+            )
+        )
+
+    def with_ingredients(self, ingredient_ids, match_all=True):
+        """
+        Рецепты, содержащие все (match_all) или любые из ингредиентов.
+
+        RecipeIngredient служит инвертированным индексом ингредиент -> рецепты:
+        составной индекс (ingredient, recipe) позволяет получить списки
+        рецептов index-only сканированием, а пересечение строится через
+        GROUP BY/HAVING без повторных JOIN на каждый ингредиент.
+        """
+        ingredient_ids = set(ingredient_ids)
+        postings = RecipeIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids
+        ).order_by()
+        if match_all:
+            # Пара (recipe, ingredient) уникальна, поэтому COUNT равен числу
+            # найденных ингредиентов рецепта
+            postings = (
+                postings.values("recipe_id")
+                .annotate(matched=Count("ingredient_id"))
+                .filter(matched=len(ingredient_ids))
+            )
+        return self.filter(pk__in=postings.values("recipe_id"))
+
+    def search(self, text):
+        """
+        Полнотекстовый поиск по названию и описанию с ранжированием.
+
+        В PostgreSQL используется search_vector (обновляется триггером)
+        и GIN-индекс, в остальных СУБД - поиск подстроки.
+        """
+        if connections[self.db].vendor == "postgresql":
+            query = SearchQuery(text, config="russian", search_type="websearch")
+            rank = SearchRank(F("search_vector"), query)
+            queryset = self.filter(search_vector=query)
+        else:
+            queryset = self.filter(Q(name__icontains=text) | Q(text__icontains=text))
+            rank = Case(When(name__icontains=text, then=Value(1.0)), default=Value(0.5))
+        return queryset.annotate(search_rank=rank).order_by(
+            "-search_rank", "-created_at", "-id"
+        )
+
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами is_favorited, is_in_shopping_cart
+        и подпиской пользователя на автора (is_subscribed_to_author).
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                is_subscribed_to_author=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_subscribed_to_author=Exists(
+                Subscription.objects.filter(user=user, subscriber=OuterRef("author"))
+            ),
+        )
+
 
 class Recipe(models.Model):
     author = models.ForeignKey(
@@ -34,19 +141,109 @@ class Recipe(models.Model):
         verbose_name="Время приготовления (мин)",
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name="Поисковый вектор"
+    )
+    # Счетчики связей обновляются вместе с ними, расхождения исправляет
+    # команда reconcile_counters
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="В избранном"
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="В списках покупок"
+    )
+    # Растет и падает вместе с favorites_count и периодически затухает
+    # командой decay_popularity
+    popularity = models.FloatField(
+        default=0, editable=False, verbose_name="Популярность"
+    )
+    # Уменьшенные копии картинки {размер: {формат: имя файла}},
+    # создаются обработчиком очереди RecipeImageTask
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Копии картинки"
+    )
+    # У рецептов, созданных до появления коротких ссылок, код заполняет
+    # команда backfill_short_codes
+    short_code = models.CharField(
+        max_length=SHORT_CODE_LENGTH,
+        unique=True,
+        null=True,
+        default=make_short_code,
+        editable=False,
+        verbose_name="Код короткой ссылки",
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
-        ordering = ["-created_at"]
+        ordering = ["-created_at", "-id"]
         indexes = [
             models.Index(fields=["author"]),
+            models.Index(
+                fields=["-created_at", "-id"], name="recipe_created_at_id_idx"
+            ),
+            models.Index(
+                fields=["-popularity", "-id"], name="recipe_popularity_id_idx"
+            ),
         ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeImageTask(models.Model):
+    """
+    Очередь создания уменьшенных копий картинок рецептов. Задачи
+    выполняет команда process_images в пуле процессов вне запросов.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="image_task",
+        verbose_name="Рецепт",
+    )
+    image = models.CharField(max_length=255, verbose_name="Картинка")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попытки")
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="Занята до")
+
+    class Meta:
+        verbose_name = "Обработка картинки"
+        verbose_name_plural = "Обработка картинок"
+
+    def __str__(self):
+        return f"{self.image} для {self.recipe_id}"
+
+
+class ImageUpload(models.Model):
+    """
+    Загрузка картинки по частям. Части дописываются в файл вне
+    MEDIA_ROOT (settings.IMAGE_UPLOAD_DIR), загруженный объем равен
+    размеру файла. Токен завершенной загрузки передается в поле
+    картинки рецепта или аватара вместо base64.
+    """
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, verbose_name="Токен")
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="image_uploads",
+        verbose_name="Пользователь",
+    )
+    size = models.PositiveIntegerField(verbose_name="Размер")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+
+    class Meta:
+        verbose_name = "Загрузка картинки"
+        verbose_name_plural = "Загрузки картинок"
+
+    def __str__(self):
+        return f"{self.token.hex} от {self.user}"
+
+
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -55,7 +252,11 @@ class RecipeIngredient(models.Model):
         verbose_name="Рецепт",
     )
     ingredient = models.ForeignKey(
-        Ingredient, on_delete=models.CASCADE, verbose_name="Ингредиент"
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name="Ингредиент",
+        # Поиск по ингредиенту обслуживает составной индекс (ingredient, recipe)
+        db_index=False,
     )
     amount = models.PositiveSmallIntegerField(
         validators=[
@@ -73,6 +274,11 @@ class RecipeIngredient(models.Model):
         verbose_name = "Ингредиент в рецепте"
         verbose_name_plural = "Ингредиенты в рецептах"
         ordering = ["recipe", "ingredient"]
+        indexes = [
+            models.Index(
+                fields=["ingredient", "recipe"], name="recipe_ingredient_lookup_idx"
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=["recipe", "ingredient"], name="unique_recipe_ingredient"
@@ -83,6 +289,76 @@ class RecipeIngredient(models.Model):
         return f"{self.ingredient} в {self.recipe}"
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """Связи пользователя с рецептом: избранное и список покупок."""
+
+    def _execute_returning(self, sql, params):
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def add_recipes(self, user_id, recipe_ids):
+        """
+        Добавляет связи одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+        Возвращает id рецептов, связи с которыми действительно созданы:
+        уже существовавшие, в том числе созданные параллельным запросом,
+        пропускаются.
+        """
+        if not recipe_ids:
+            return []
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        created_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        rows = self._execute_returning(
+            f"INSERT INTO {quote_name(self.model._meta.db_table)} "
+            f"({quote_name('user_id')}, {quote_name('recipe_id')}, "
+            f"{quote_name('created_at')}) VALUES "
+            + ", ".join(["(%s, %s, %s)"] * len(recipe_ids))
+            + f" ON CONFLICT DO NOTHING RETURNING {quote_name('recipe_id')}",
+            [
+                value
+                for recipe_id in recipe_ids
+                for value in (user_id, recipe_id, created_at)
+            ],
+        )
+        return [recipe_id for (recipe_id,) in rows]
+
+    def remove_recipes(self, user_id, recipe_ids):
+        """
+        Удаляет связи одним DELETE ... RETURNING. Возвращает
+        {id рецепта: время добавления связи} для действительно удаленных
+        связей.
+        """
+        if not recipe_ids:
+            return {}
+        quote_name = connections[self.db].ops.quote_name
+        rows = self._execute_returning(
+            f"DELETE FROM {quote_name(self.model._meta.db_table)} "
+            f"WHERE {quote_name('user_id')} = %s AND {quote_name('recipe_id')} IN ("
+            + ", ".join(["%s"] * len(recipe_ids))
+            + f") RETURNING {quote_name('recipe_id')}, {quote_name('created_at')}",
+            [user_id, *recipe_ids],
+        )
+        field = self.model._meta.get_field("created_at")
+        removed = {}
+        for recipe_id, created_at in rows:
+            # SQLite возвращает строку с временем UTC без часового пояса
+            created_at = field.to_python(created_at)
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at, datetime.timezone.utc)
+            removed[recipe_id] = created_at
+        return removed
+
+    def add_recipe(self, user_id, recipe_id):
+        """Добавляет связь. Возвращает False, если она уже была."""
+        return bool(self.add_recipes(user_id, [recipe_id]))
+
+    def remove_recipe(self, user_id, recipe_id):
+        """Удаляет связь. Возвращает False, если ее не было."""
+        return bool(self.remove_recipes(user_id, [recipe_id]))
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -91,6 +367,12 @@ class Favorite(models.Model):
         verbose_name="Пользователь",
     )
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, verbose_name="Рецепт")
+    # По времени добавления вычисляется вклад связи в популярность рецепта
+    created_at = models.DateTimeField(
+        default=timezone.now, editable=False, verbose_name="Дата добавления"
+    )
+
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Избранное"
@@ -117,6 +399,11 @@ class ShoppingCart(models.Model):
         verbose_name="Рецепт",
         related_name="shopping_cart",
     )
+    created_at = models.DateTimeField(
+        default=timezone.now, editable=False, verbose_name="Дата добавления"
+    )
+
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Список покупок"
@@ -130,3 +417,34 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f"{self.user} добавил {self.recipe} в список покупок"
+
+
+class ShoppingListItem(models.Model):
+    """
+    Сумма ингредиента по всем рецептам из списка покупок пользователя.
+    Обновляется вместе со списком покупок и ингредиентами рецептов,
+    пересобирается командой rebuild_shopping_lists.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, verbose_name="Ингредиент"
+    )
+    total_amount = models.IntegerField(verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Позиции списков покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"], name="unique_shopping_list_item"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient} для {self.user}: {self.total_amount}"
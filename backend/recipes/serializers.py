@@ -1,19 +1,25 @@
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
 from rest_framework import serializers
-from .models import Recipe, RecipeIngredient, Favorite, ShoppingCart
+from .cache import get_recipe_payloads, invalidate_recipes, set_recipe_payloads
+from .counters import change_counter
+from .images import LIST_IMAGE_VARIANT, enqueue_image_variants, get_variant_url
+from .models import ImageUpload, Recipe, RecipeIngredient, Favorite, ShoppingCart
+from .shopping_list import change_shopping_lists
+from .uploads import get_upload_offset, open_upload
+from ingredients.cache import get_known_ingredient_ids
 from ingredients.models import Ingredient
+from users.models import User
 from users.serializers import UserSerializer
 from utils.serializers import Base64ImageField
 
+MAX_BULK_RECIPES = 100
+
 
 class IngredientInRecipeWriteSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=1, max_value=32000)
 
-    def validate_id(self, value):
-        if not Ingredient.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Ингредиент с таким ID не существует.")
-        return value
-
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(source="ingredient.id")
@@ -25,18 +31,72 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления в избранное и покупки."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Загрузка картинки по частям: токен, размер и загруженный объем."""
+
+    token = serializers.UUIDField(format="hex", read_only=True)
+    offset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ("token", "size", "offset")
+
+    def validate_size(self, value):
+        max_size = settings.MAX_IMAGE_UPLOAD_SIZE
+        if not 0 < value <= max_size:
+            raise serializers.ValidationError(
+                f"Размер картинки должен быть от 1 байта до "
+                f"{max_size // (1024 * 1024)} МБ."
+            )
+        return value
+
+    def get_offset(self, obj):
+        return get_upload_offset(obj)
+
+
 class RecipeShortSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ("id", "name", "image", "cooking_time")
 
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        # Пока копии не готовы, отдается исходная картинка
+        url = get_variant_url(instance.image_variants)
+        if url:
+            request = self.context.get("request")
+            representation["image"] = (
+                request.build_absolute_uri(url) if request else url
+            )
+        return representation
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, models.manager.BaseManager) else data
+        # В списках отдаются уменьшенные копии картинок
+        return self.child.to_representations(
+            list(recipes), image_variant=LIST_IMAGE_VARIANT
+        )
+
 
 class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeWriteSerializer(many=True, write_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = Base64ImageField(open_upload=open_upload)
+    image_variants = serializers.SerializerMethodField()
     cooking_time = serializers.IntegerField(min_value=1, max_value=32000)
 
     class Meta:
@@ -49,9 +109,11 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
         )
+        list_serializer_class = RecipeListSerializer
 
     def validate(self, data):
         ingredients = data.get("ingredients")
@@ -62,6 +124,21 @@ class RecipeSerializer(serializers.ModelSerializer):
             )
 
         ingredient_ids = [ingredient["id"] for ingredient in ingredients]
+        missing = self.get_missing_ingredient_ids(ingredient_ids)
+        if missing:
+            raise serializers.ValidationError(
+                {
+                    "ingredients": [
+                        (
+                            {"id": ["Ингредиент с таким ID не существует."]}
+                            if ingredient_id in missing
+                            else {}
+                        )
+                        for ingredient_id in ingredient_ids
+                    ]
+                }
+            )
+
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise serializers.ValidationError(
                 {"ingredients": "Ингредиенты не должны повторяться."}
@@ -71,18 +148,58 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         return data
 
+    @staticmethod
+    def get_missing_ingredient_ids(ingredient_ids):
+        """
+        Id, которых нет среди ингредиентов. Проверка идет по множеству id
+        в памяти процесса, а неизвестные ему id проверяются одним запросом:
+        ингредиент мог быть добавлен в другом процессе.
+        """
+        missing = set(ingredient_ids) - get_known_ingredient_ids()
+        if missing:
+            missing -= set(
+                Ingredient.objects.filter(id__in=missing).values_list("id", flat=True)
+            )
+        return missing
+
+    def get_image_variants(self, obj):
+        """Пути уменьшенных копий {размер: {формат: путь}}, пока без хоста."""
+        return {
+            size: {
+                extension: obj.image.storage.url(name)
+                for extension, name in formats.items()
+            }
+            for size, formats in obj.image_variants.items()
+        }
+
     def get_is_favorited(self, obj):
+        # Флаг обычно уже посчитан подзапросом в RecipeViewSet.get_queryset
+        is_favorited = getattr(obj, "is_favorited", None)
+        if is_favorited is not None:
+            return is_favorited
         user = self.context["request"].user
         if user.is_anonymous:
             return False
         return user.favorites.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        is_in_shopping_cart = getattr(obj, "is_in_shopping_cart", None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         user = self.context["request"].user
         if user.is_anonymous:
             return False
         return user.shopping_cart_items.filter(recipe=obj).exists()
 
+    def get_is_subscribed_to_author(self, obj):
+        is_subscribed = getattr(obj, "is_subscribed_to_author", None)
+        if is_subscribed is not None:
+            return is_subscribed
+        user = self.context["request"].user
+        if user.is_anonymous:
+            return False
+        return user.subscriptions.filter(subscriber_id=obj.author_id).exists()
+
     def _create_recipe_ingredients(self, recipe, ingredients_data):
         """Метод для создания связанных ингредиентов для рецепта"""
         recipe_ingredients = [
@@ -93,8 +210,72 @@ class RecipeSerializer(serializers.ModelSerializer):
             )
             for ingredient_data in ingredients_data
         ]
+        if not recipe_ingredients:
+            return
         RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        # Внешние ключи проверяются сразу, а не при коммите: ингредиент
+        # мог быть удален после проверки в validate, которая опирается
+        # на множество id в памяти процесса
+        try:
+            connection.check_constraints(table_names=[RecipeIngredient._meta.db_table])
+        except IntegrityError:
+            raise serializers.ValidationError(
+                {"ingredients": "Ингредиент с таким ID не существует."}
+            )
+
+    def _update_recipe_ingredients(self, recipe, ingredients_data):
+        """
+        Приводит ингредиенты рецепта к ingredients_data, затрагивая только
+        изменившиеся строки: новые добавляются, измененные количества
+        обновляются, лишние удаляются.
+        """
+        amounts = {
+            ingredient_data["id"]: ingredient_data["amount"]
+            for ingredient_data in ingredients_data
+        }
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(recipe=recipe)
+            .only("id", "ingredient_id", "amount")
+            .order_by()
+        }
+        removed = [
+            recipe_ingredient.pk
+            for ingredient_id, recipe_ingredient in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        # Изменения количеств для списков покупок, где есть этот рецепт
+        deltas = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        }
+        for ingredient_id, recipe_ingredient in current.items():
+            amount = amounts.get(ingredient_id, 0)
+            deltas[ingredient_id] = amount - recipe_ingredient.amount
+            if amount and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        self._create_recipe_ingredients(
+            recipe,
+            [
+                ingredient_data
+                for ingredient_data in ingredients_data
+                if ingredient_data["id"] not in current
+            ],
+        )
+        if any(deltas.values()):
+            change_shopping_lists(
+                list(recipe.shopping_cart.values_list("user_id", flat=True)),
+                deltas,
+            )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("ingredients")
         image = validated_data.pop("image", None)
@@ -102,26 +283,127 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(
             author=self.context["request"].user, image=image, **validated_data
         )
+        change_counter(User.objects.filter(pk=recipe.author_id), "recipes_count", 1)
+        enqueue_image_variants(recipe)
         self._create_recipe_ingredients(recipe, ingredients_data)
         return recipe
 
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop("ingredients", None)
-        instance.name = validated_data.get("name", instance.name)
-        instance.text = validated_data.get("text", instance.text)
-        instance.cooking_time = validated_data.get(
-            "cooking_time", instance.cooking_time
-        )
-        instance.image = validated_data.get("image", instance.image)
-        instance.save()
-        if ingredients_data:
-            instance.recipe_ingredients.all().delete()
-            self._create_recipe_ingredients(instance, ingredients_data)
+        stale_version = (instance.pk, instance.updated_at)
+        with transaction.atomic():
+            instance.name = validated_data.get("name", instance.name)
+            instance.text = validated_data.get("text", instance.text)
+            instance.cooking_time = validated_data.get(
+                "cooking_time", instance.cooking_time
+            )
+            if "image" in validated_data:
+                # Копии старой картинки больше не подходят, до готовности
+                # новых отдается исходная картинка
+                instance.image = validated_data["image"]
+                instance.image_variants = {}
+            instance.save()
+            if "image" in validated_data:
+                enqueue_image_variants(instance)
+            if ingredients_data:
+                self._update_recipe_ingredients(instance, ingredients_data)
+        # save() обновил updated_at, а с ним и ключ кэша
+        invalidate_recipes([stale_version])
         return instance
 
     def to_representation(self, instance):
+        return self.to_representations([instance])[0]
+
+    def to_representations(self, recipes, image_variant=None):
+        """
+        Общая для всех пользователей часть рецептов берется из кэша одним
+        multi-get, промахи собираются из БД фиксированным числом запросов.
+        Флаги текущего пользователя добавляются поверх. image_variant -
+        (размер, формат) копии, которая отдается в поле image вместо
+        исходной картинки.
+        """
+        payloads = get_recipe_payloads(recipes)
+        sources = {recipe.pk: recipe for recipe in recipes}
+        missing = [recipe.pk for recipe in recipes if recipe.pk not in payloads]
+        if missing:
+            fresh = []
+            for recipe in self._load_recipes(recipes, missing):
+                sources[recipe.pk] = recipe
+                payloads[recipe.pk] = self.get_shared_representation(recipe)
+                # Ключ по updated_at загруженной строки, из которой собрано
+                # представление
+                fresh.append((recipe, payloads[recipe.pk]))
+            set_recipe_payloads(fresh)
+        return [
+            self.personalize(sources[recipe.pk], payloads[recipe.pk], image_variant)
+            for recipe in recipes
+            if recipe.pk in payloads
+        ]
+
+    def _load_recipes(self, recipes, recipe_ids):
+        """Полностью загруженные рецепты используются как есть, остальные догружаются."""
+        loaded = [
+            recipe
+            for recipe in recipes
+            if recipe.pk in recipe_ids
+            and not recipe.get_deferred_fields()
+            and "recipe_ingredients" in getattr(recipe, "_prefetched_objects_cache", {})
+        ]
+        if len(loaded) == len(recipe_ids):
+            return loaded
+        return (
+            Recipe.objects.with_related()
+            .with_user_flags(self.context["request"].user)
+            .filter(pk__in=recipe_ids)
+        )
+
+    def get_shared_representation(self, instance):
+        """Представление рецепта без данных текущего пользователя."""
+        is_subscribed = getattr(instance, "is_subscribed_to_author", None)
+        if is_subscribed is not None:
+            # Передаем подписку, посчитанную в queryset, во вложенный UserSerializer
+            instance.author.is_subscribed = is_subscribed
         representation = super().to_representation(instance)
         representation["ingredients"] = RecipeIngredientSerializer(
             instance.recipe_ingredients.all(), many=True
         ).data
+        # Персональные поля заполняются в personalize, в кэш они не попадают
+        representation["is_favorited"] = None
+        representation["is_in_shopping_cart"] = None
+        representation["author"]["is_subscribed"] = None
+        # Абсолютные URL зависят от хоста запроса, поэтому в кэше хранятся пути
+        representation["image"] = instance.image.url if instance.image else None
+        avatar = instance.author.avatar
+        representation["author"]["avatar"] = avatar.url if avatar else None
+        return representation
+
+    def personalize(self, instance, payload, image_variant=None):
+        request = self.context["request"]
+        representation = dict(payload)
+        if representation["image"]:
+            representation["image"] = request.build_absolute_uri(
+                representation["image"]
+            )
+        representation["image_variants"] = {
+            size: {
+                extension: request.build_absolute_uri(url)
+                for extension, url in formats.items()
+            }
+            for size, formats in payload["image_variants"].items()
+        }
+        if image_variant is not None:
+            size, extension = image_variant
+            variant = representation["image_variants"].get(size, {}).get(extension)
+            if variant:
+                representation["image"] = variant
+        representation["is_favorited"] = self.get_is_favorited(instance)
+        representation["is_in_shopping_cart"] = self.get_is_in_shopping_cart(instance)
+        representation["author"] = dict(payload["author"])
+        representation["author"]["is_subscribed"] = self.get_is_subscribed_to_author(
+            instance
+        )
+        if representation["author"]["avatar"]:
+            representation["author"]["avatar"] = request.build_absolute_uri(
+                representation["author"]["avatar"]
+            )
         return representation
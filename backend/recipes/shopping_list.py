@@ -0,0 +1,224 @@
+import csv
+import json
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from utils.pdf import render_pdf
+from .models import RecipeIngredient, ShoppingListItem
+
+SHOPPING_LIST_TITLE = "Список покупок:"
+CSV_HEADER = ("Ингредиент", "Единица измерения", "Количество")
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Рендереры нужны DRF, чтобы выбрать формат по ?format= и Accept.
+    Сам список отдается потоком из RecipeViewSet.download_shopping_cart,
+    через render проходят только ответы с ошибками.
+    """
+
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return JSONRenderer().render(data)
+
+
+class TextRenderer(ShoppingListRenderer):
+    media_type = "text/plain"
+    format = "txt"
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = "application/json"
+    format = "json"
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = "application/pdf"
+    format = "pdf"
+    charset = None
+
+
+def get_shopping_list(user):
+    """
+    Список покупок пользователя из заранее посчитанных сумм ShoppingListItem,
+    отсортированный в БД. Строки читаются пачками, без загрузки всего
+    списка в память.
+    """
+    return (
+        ShoppingListItem.objects.filter(user=user)
+        .values("ingredient__name", "ingredient__measurement_unit", "total_amount")
+        .order_by("ingredient__name", "ingredient__measurement_unit")
+        .iterator(chunk_size=2000)
+    )
+
+
+def change_shopping_lists(user_ids, amounts):
+    """
+    Прибавляет к спискам покупок пользователей количества ингредиентов
+    {ingredient_id: количество}; отрицательные количества вычитаются,
+    позиции с нулевым остатком удаляются.
+
+    Недостающие позиции сначала вставляются с нулем, затем все меняются
+    одним UPDATE с приращением, поэтому параллельные изменения одной
+    позиции не теряются.
+    """
+    amounts = {
+        ingredient_id: amount for ingredient_id, amount in amounts.items() if amount
+    }
+    if not user_ids or not amounts:
+        return
+    with transaction.atomic(savepoint=False):
+        ShoppingListItem.objects.bulk_create(
+            (
+                ShoppingListItem(
+                    user_id=user_id, ingredient_id=ingredient_id, total_amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id, amount in amounts.items()
+                if amount > 0
+            ),
+            ignore_conflicts=True,
+        )
+        items = ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=amounts
+        )
+        items.update(
+            total_amount=F("total_amount")
+            + Case(
+                *(
+                    When(ingredient_id=ingredient_id, then=Value(amount))
+                    for ingredient_id, amount in amounts.items()
+                ),
+                default=Value(0),
+            )
+        )
+        if any(amount < 0 for amount in amounts.values()):
+            items.filter(total_amount__lte=0).delete()
+
+
+def change_recipes_in_shopping_lists(recipe_ids, user_ids, sign=1):
+    """Добавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов."""
+    if not recipe_ids or not user_ids:
+        return
+    amounts = (
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .values_list("ingredient_id")
+        .annotate(total_amount=Sum("amount"))
+        .order_by()
+    )
+    change_shopping_lists(
+        user_ids, {ingredient_id: sign * amount for ingredient_id, amount in amounts}
+    )
+
+
+def get_shopping_list_totals(user_ids=None):
+    """Суммы ингредиентов, посчитанные заново по спискам покупок."""
+    if user_ids is None:
+        lookup = {"recipe__shopping_cart__isnull": False}
+    else:
+        lookup = {"recipe__shopping_cart__user__in": user_ids}
+    return (
+        RecipeIngredient.objects.filter(**lookup)
+        .values("recipe__shopping_cart__user", "ingredient")
+        .annotate(total_amount=Sum("amount"))
+        .order_by()
+    )
+
+
+@transaction.atomic
+def rebuild_shopping_lists(user_ids=None):
+    """
+    Пересобирает ShoppingListItem всех или указанных пользователей
+    одним INSERT ... SELECT. Возвращает число созданных позиций.
+    """
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    sql, params = get_shopping_list_totals(user_ids).query.sql_with_params()
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(
+        quote_name(ShoppingListItem._meta.get_field(field).column)
+        for field in ("user", "ingredient", "total_amount")
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote_name(ShoppingListItem._meta.db_table)} "
+            f"({columns}) {sql}",
+            params,
+        )
+        return cursor.rowcount
+
+
+def format_line(item):
+    return (
+        f"{item['ingredient__name']} "
+        f"({item['ingredient__measurement_unit']}) — "
+        f"{item['total_amount']}"
+    )
+
+
+def render_txt(items):
+    yield f"{SHOPPING_LIST_TITLE}\n\n"
+    for item in items:
+        yield format_line(item) + "\n"
+
+
+class Echo:
+    """Файлоподобный объект для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for item in items:
+        yield writer.writerow(
+            (
+                item["ingredient__name"],
+                item["ingredient__measurement_unit"],
+                item["total_amount"],
+            )
+        )
+
+
+def render_json(items):
+    separator = "["
+    for item in items:
+        yield separator + json.dumps(
+            {
+                "name": item["ingredient__name"],
+                "measurement_unit": item["ingredient__measurement_unit"],
+                "amount": item["total_amount"],
+            },
+            ensure_ascii=False,
+        )
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def render_shopping_list_pdf(items):
+    return render_pdf(
+        (format_line(item) for item in items),
+        settings.SHOPPING_LIST_PDF_FONT,
+        title=SHOPPING_LIST_TITLE,
+    )
+
+
+EXPORTERS = {
+    "txt": render_txt,
+    "csv": render_csv,
+    "json": render_json,
+    "pdf": render_shopping_list_pdf,
+}
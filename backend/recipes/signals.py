@@ -0,0 +1,73 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from ingredients.models import Ingredient
+from users.models import User
+from .cache import forget_short_code, touch_recipes
+from .counters import change_counter, change_recipe_counters
+from .models import Favorite, Recipe, ShoppingCart
+from .shopping_list import change_recipes_in_shopping_lists
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """
+    Вычитает из счетчиков и чужих списков покупок вклад удаляемого
+    пользователя: его избранное, список покупок, подписки и рецепты
+    удаляются каскадом, минуя change_counter.
+    """
+    change_recipe_counters(
+        Favorite,
+        dict(
+            Favorite.objects.filter(user=instance).values_list(
+                "recipe_id", "created_at"
+            )
+        ),
+        -1,
+    )
+    change_recipe_counters(
+        ShoppingCart,
+        list(
+            ShoppingCart.objects.filter(user=instance).values_list(
+                "recipe_id", flat=True
+            )
+        ),
+        -1,
+    )
+    change_counter(
+        User.objects.filter(subscribers__user=instance), "subscribers_count", -1
+    )
+    # Рецепты пользователя в списках покупок других пользователей
+    cart_users = defaultdict(list)
+    for recipe_id, user_id in (
+        ShoppingCart.objects.filter(recipe__author=instance)
+        .exclude(user=instance)
+        .values_list("recipe_id", "user_id")
+    ):
+        cart_users[recipe_id].append(user_id)
+    for recipe_id, user_ids in cart_users.items():
+        change_recipes_in_shopping_lists([recipe_id], user_ids, sign=-1)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_changed(sender, instance, created=False, **kwargs):
+    """
+    Название и единица измерения ингредиента входят в представления
+    рецептов с ним, поэтому эти рецепты обновляются. При удалении
+    рецепты находятся до каскадного удаления их строк с ингредиентом.
+    """
+    if not created:
+        touch_recipes(Recipe.objects.filter(recipe_ingredients__ingredient=instance))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """
+    Короткая ссылка удаленного рецепта перестает работать. Запись кэша
+    удаляется после фиксации транзакции: до нее параллельный переход
+    по ссылке еще находит рецепт и мог бы снова положить его в кэш.
+    """
+    if instance.short_code:
+        transaction.on_commit(lambda: forget_short_code(instance.short_code))
@@ -0,0 +1,1576 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from unittest import mock
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django import forms
+from django.forms import MultiWidget
+from django.test import RequestFactory, override_settings
+from django.shortcuts import get_object_or_404
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from foodgram_backend.testing import make_image
+from ingredients.models import Ingredient
+from users.models import User, Subscription
+from .cache import get_recipe_payloads, set_recipe_payloads, short_code_cache_key
+from .models import (
+    ImageUpload,
+    Recipe,
+    RecipeImageTask,
+    RecipeIngredient,
+    Favorite,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from .images import complete_image_task, run_image_task
+from .serializers import RecipeSerializer
+from .shopping_list import get_shopping_list_totals, rebuild_shopping_lists
+
+
+def get_admin_form_data(obj, **changes):
+    """Данные формы изменения объекта в admin с его текущими значениями."""
+    model_admin = admin.site._registry[type(obj)]
+    request = RequestFactory().get("/")
+    request.user = User(is_superuser=True, is_staff=True)
+    form = model_admin.get_form(request, obj)(instance=obj)
+    data = {}
+    for field in form:
+        value = field.value()
+        if isinstance(field.field.widget, MultiWidget):
+            for index, part in enumerate(field.field.widget.decompress(value)):
+                data[f"{field.html_name}_{index}"] = "" if part is None else part
+        elif isinstance(value, (list, tuple)):
+            data[field.html_name] = list(value)
+        elif isinstance(field.field, forms.FileField):
+            continue
+        elif value is not None and value is not False:
+            data[field.html_name] = value
+    data.update(changes)
+    return data
+
+
+def get_admin_recipe_data(recipe, **changes):
+    """Данные формы изменения рецепта в admin с текущими ингредиентами."""
+    ingredients = list(recipe.recipe_ingredients.all())
+    data = {
+        "author": recipe.author_id,
+        "name": recipe.name,
+        "text": recipe.text,
+        "cooking_time": recipe.cooking_time,
+        "recipe_ingredients-TOTAL_FORMS": len(ingredients),
+        "recipe_ingredients-INITIAL_FORMS": len(ingredients),
+        "recipe_ingredients-MIN_NUM_FORMS": 1,
+        "recipe_ingredients-MAX_NUM_FORMS": 1000,
+    }
+    for number, item in enumerate(ingredients):
+        prefix = f"recipe_ingredients-{number}-"
+        data.update(
+            {
+                f"{prefix}id": item.id,
+                f"{prefix}recipe": recipe.id,
+                f"{prefix}ingredient": item.ingredient_id,
+                f"{prefix}amount": item.amount,
+            }
+        )
+    data.update(changes)
+    return data
+
+
+class RecipeListQueriesTest(APITestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    # COUNT для пагинации, страница id рецептов с флагами пользователя,
+    # рецепты с авторами для промахов кэша, prefetch ингредиентов
+    LIST_QUERIES = 4
+    # При прогретом кэше остаются только COUNT и страница с флагами
+    CACHED_LIST_QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f"ингредиент{i}", measurement_unit="г")
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def create_recipes(self, count):
+        for i in range(count):
+            author = User.objects.create_user(
+                username=f"author{Recipe.objects.count()}",
+                email=f"author{Recipe.objects.count()}@example.com",
+                password="password123",
+            )
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f"Рецепт {i}",
+                image="recipes/test.jpg",
+                text="Описание",
+                cooking_time=10,
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=i + 1)
+                for ingredient in self.ingredients
+            )
+            Favorite.objects.create(user=self.user, recipe=recipe)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+            Subscription.objects.create(user=self.user, subscriber=author)
+
+    def test_list_query_count_is_constant(self):
+        self.create_recipes(1)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get("/api/recipes/")
+        self.assertEqual(len(response.data["results"]), 1)
+
+        self.create_recipes(9)
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get("/api/recipes/", {"limit": 10})
+        self.assertEqual(len(response.data["results"]), 10)
+
+        with self.assertNumQueries(self.CACHED_LIST_QUERIES):
+            cached_response = self.client.get("/api/recipes/", {"limit": 10})
+        self.assertEqual(cached_response.data, response.data)
+
+        recipe = response.data["results"][0]
+        self.assertTrue(recipe["is_favorited"])
+        self.assertTrue(recipe["is_in_shopping_cart"])
+        self.assertTrue(recipe["author"]["is_subscribed"])
+        self.assertEqual(len(recipe["ingredients"]), len(self.ingredients))
+
+    def test_detail_query_count(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        # Рецепт с флагами, затем рецепт с автором и prefetch ингредиентов
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/recipes/{recipe.id}/")
+        self.assertEqual(len(response.data["ingredients"]), len(self.ingredients))
+        with self.assertNumQueries(1):
+            self.client.get(f"/api/recipes/{recipe.id}/")
+
+    def test_cache_is_invalidated_on_update(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        self.client.get(f"/api/recipes/{recipe.id}/")
+        self.client.force_authenticate(recipe.author)
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/",
+            {
+                "name": "Новое название",
+                "ingredients": [{"id": self.ingredients[0].id, "amount": 7}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f"/api/recipes/{recipe.id}/")
+        self.assertEqual(response.data["name"], "Новое название")
+        self.assertEqual(
+            [ingredient["amount"] for ingredient in response.data["ingredients"]], [7]
+        )
+
+    def test_stale_payload_is_not_served_after_change_elsewhere(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        self.client.get(f"/api/recipes/{recipe.id}/")
+        # Изменение в другом процессе без сброса кэша этого процесса
+        Recipe.objects.filter(pk=recipe.pk).update(
+            name="Новое название", updated_at=timezone.now()
+        )
+        response = self.client.get(f"/api/recipes/{recipe.id}/")
+        self.assertEqual(response.data["name"], "Новое название")
+        # Запоздавшая запись старого представления не видна новой версии
+        set_recipe_payloads([(recipe, {"name": "Старое название"})])
+        response = self.client.get("/api/recipes/")
+        self.assertEqual(response.data["results"][0]["name"], "Новое название")
+
+    def test_cursor_pagination_walks_all_recipes(self):
+        self.create_recipes(5)
+        seen = []
+        url = "/api/recipes/?pagination=cursor&limit=2"
+        while url:
+            # Страница рецептов и prefetch ингредиентов, без COUNT(*)
+            with self.assertNumQueries(self.LIST_QUERIES - 1):
+                response = self.client.get(url)
+            seen.extend(recipe["id"] for recipe in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, list(Recipe.objects.values_list("id", flat=True)))
+
+    def test_cursor_pagination_uses_keyset_for_equal_created_at(self):
+        self.create_recipes(5)
+        # Одно время создания у всех рецептов: порядок задает только id
+        Recipe.objects.update(created_at=timezone.now())
+        seen = []
+        url = "/api/recipes/?pagination=cursor&limit=2"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any("OFFSET" in query["sql"].upper() for query in queries))
+            seen.extend(recipe["id"] for recipe in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 5)
+
+
+class RecipeConditionalGetTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user,
+            name="Рецепт",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=10,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_not_modified_without_serialization(self):
+        for url in ("/api/recipes/", f"/api/recipes/{self.recipe.id}/"):
+            response = self.client.get(url)
+            self.assertIn("Authorization", response["Vary"])
+            cache.clear()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+            # Кэш представлений не заполнялся: тело ответа не собиралось
+            self.assertEqual(get_recipe_payloads([self.recipe]), {})
+
+    def test_etag_changes_with_user_flags(self):
+        url = f"/api/recipes/{self.recipe.id}/"
+        etag = self.client.get(url)["ETag"]
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["is_favorited"])
+
+    def test_admin_changes_refresh_payload(self):
+        ingredient = Ingredient.objects.create(name="соль", measurement_unit="г")
+        item = RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=ingredient, amount=1
+        )
+        url = f"/api/recipes/{self.recipe.id}/"
+        etag = self.client.get(url)["ETag"]
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password123"
+        )
+        self.client.force_login(admin)
+        response = self.client.post(
+            f"/admin/recipes/recipeingredient/{item.id}/delete/", {"post": "yes"}
+        )
+        self.assertEqual(response.status_code, 302)
+        data = get_admin_form_data(
+            self.user, first_name="Новое имя", last_name="Новая фамилия"
+        )
+        response = self.client.post(f"/admin/users/user/{self.user.id}/change/", data)
+        self.assertEqual(response.status_code, 302)
+
+        self.client.force_authenticate(None)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["ingredients"], [])
+        self.assertEqual(response.data["author"]["first_name"], "Новое имя")
+
+    def test_ingredient_rename_changes_payload_and_etag(self):
+        ingredient = Ingredient.objects.create(name="соль", measurement_unit="г")
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=ingredient, amount=1
+        )
+        url = f"/api/recipes/{self.recipe.id}/"
+        response = self.client.get(url)
+        self.assertEqual(response.data["ingredients"][0]["name"], "соль")
+        ingredient.name = "морская соль"
+        ingredient.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["ingredients"][0]["name"], "морская соль")
+
+
+class RecipeSearchTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.in_text = Recipe.objects.create(
+            author=author,
+            name="Обед",
+            image="recipes/test.jpg",
+            text="Сварите борщ на говяжьем бульоне",
+            cooking_time=90,
+        )
+        cls.in_name = Recipe.objects.create(
+            author=author,
+            name="борщ",
+            image="recipes/test.jpg",
+            text="Классический рецепт",
+            cooking_time=120,
+        )
+        Recipe.objects.create(
+            author=author,
+            name="Салат",
+            image="recipes/test.jpg",
+            text="Нарежьте овощи",
+            cooking_time=10,
+        )
+
+    def test_search_ranks_name_matches_first(self):
+        response = self.client.get("/api/recipes/", {"search": "борщ"})
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [self.in_name.id, self.in_text.id],
+        )
+
+
+class RecipeIngredientsFilterTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.salt, cls.pepper, cls.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("соль", "перец", "сахар")
+        )
+        cls.both = Recipe.objects.create(
+            author=author,
+            name="Соль и перец",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=10,
+        )
+        cls.salt_only = Recipe.objects.create(
+            author=author,
+            name="Только соль",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=10,
+        )
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(recipe=cls.both, ingredient=cls.salt, amount=1),
+                RecipeIngredient(recipe=cls.both, ingredient=cls.pepper, amount=1),
+                RecipeIngredient(recipe=cls.salt_only, ingredient=cls.salt, amount=1),
+            ]
+        )
+
+    def get_ids(self, params):
+        response = self.client.get("/api/recipes/", params)
+        return {recipe["id"] for recipe in response.data["results"]}
+
+    def test_match_all_and_any(self):
+        ingredients = f"{self.salt.id},{self.pepper.id}"
+        self.assertEqual(self.get_ids({"ingredients": ingredients}), {self.both.id})
+        self.assertEqual(
+            self.get_ids({"ingredients": ingredients, "ingredients_match": "any"}),
+            {self.both.id, self.salt_only.id},
+        )
+        self.assertEqual(self.get_ids({"ingredients": self.sugar.id}), set())
+
+    def test_invalid_ids(self):
+        response = self.client.get("/api/recipes/", {"ingredients": "соль"})
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeUpdateTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.salt, cls.pepper, cls.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("соль", "перец", "сахар")
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name="Рецепт",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=10,
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=cls.recipe, ingredient=ingredient, amount=1)
+            for ingredient in (cls.salt, cls.pepper)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.author)
+
+    def test_only_changed_ingredients_are_touched(self):
+        salt_row = RecipeIngredient.objects.get(
+            recipe=self.recipe, ingredient=self.salt
+        )
+        # Худший случай разницы ингредиентов: вставка, изменение и удаление
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f"/api/recipes/{self.recipe.id}/",
+                {
+                    "ingredients": [
+                        {"id": self.salt.id, "amount": 5},
+                        {"id": self.sugar.id, "amount": 2},
+                    ]
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), settings.QUERY_BUDGETS["PATCH recipe-detail"]
+        )
+        rows = RecipeIngredient.objects.filter(recipe=self.recipe)
+        self.assertEqual(
+            {row.ingredient_id: row.amount for row in rows},
+            {self.salt.id: 5, self.sugar.id: 2},
+        )
+        # Строка с измененным количеством обновлена, а не пересоздана
+        self.assertEqual(rows.get(ingredient=self.salt).pk, salt_row.pk)
+
+    def test_missing_and_foreign_recipes(self):
+        response = self.client.patch("/api/recipes/0/", {}, format="json")
+        self.assertEqual(response.status_code, 404)
+        self.client.force_authenticate(
+            User.objects.create_user(username="other", email="other@example.com")
+        )
+        response = self.client.patch(
+            f"/api/recipes/{self.recipe.id}/", {}, format="json"
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_ingredients_are_reported_per_item(self):
+        response = self.client.patch(
+            f"/api/recipes/{self.recipe.id}/",
+            {
+                "ingredients": [
+                    {"id": self.salt.id, "amount": 1},
+                    {"id": 0, "amount": 1},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data["ingredients"],
+            [{}, {"id": ["Ингредиент с таким ID не существует."]}],
+        )
+
+    def test_ingredients_are_validated_in_one_query(self):
+        ingredient_ids = [self.salt.id, self.pepper.id, self.sugar.id]
+        with self.assertNumQueries(1):
+            missing = RecipeSerializer.get_missing_ingredient_ids(ingredient_ids)
+        self.assertEqual(missing, set())
+        # Множество id закэшировано в процессе до изменения ингредиентов
+        with self.assertNumQueries(0):
+            RecipeSerializer.get_missing_ingredient_ids(ingredient_ids)
+        new = Ingredient.objects.create(name="мед", measurement_unit="г")
+        with self.assertNumQueries(1):
+            missing = RecipeSerializer.get_missing_ingredient_ids([new.id])
+        self.assertEqual(missing, set())
+
+    def test_ingredient_deleted_elsewhere_is_a_validation_error(self):
+        sugar_id = self.sugar.id
+        RecipeSerializer.get_missing_ingredient_ids([sugar_id])
+        # Удаление в другом процессе, пока версия данных до этого еще не дошла
+        with mock.patch("ingredients.signals.bump_ingredients_version"):
+            Ingredient.objects.filter(pk=sugar_id).delete()
+        response = self.client.patch(
+            f"/api/recipes/{self.recipe.id}/",
+            {"ingredients": [{"id": sugar_id, "amount": 2}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ingredients", response.data)
+        self.assertEqual(
+            set(
+                RecipeIngredient.objects.filter(recipe=self.recipe).values_list(
+                    "ingredient_id", flat=True
+                )
+            ),
+            {self.salt.id, self.pepper.id},
+        )
+
+
+class ShoppingListExportTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="password123"
+        )
+        salt, flour = (
+            Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("соль", "мука")
+        )
+        for amounts in ((1, 100), (2, 200)):
+            recipe = Recipe.objects.create(
+                author=cls.user,
+                name="Рецепт",
+                image="recipes/test.jpg",
+                text="Описание",
+                cooking_time=10,
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+                for ingredient, amount in zip((salt, flour), amounts)
+            )
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.recipes = list(Recipe.objects.all())
+        rebuild_shopping_lists()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def download(self, export_format=None):
+        params = {"format": export_format} if export_format else {}
+        response = self.client.get("/api/recipes/download_shopping_cart/", params)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def test_txt_is_default(self):
+        response, content = self.download()
+        self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+        self.assertEqual(
+            content.decode(),
+            "Список покупок:\n\nмука (г) — 300\nсоль (г) — 3\n",
+        )
+
+    def test_csv_and_json(self):
+        response, content = self.download("csv")
+        self.assertIn("shopping_list.csv", response["Content-Disposition"])
+        self.assertEqual(
+            content.decode().splitlines(),
+            ["Ингредиент,Единица измерения,Количество", "мука,г,300", "соль,г,3"],
+        )
+        _, content = self.download("json")
+        self.assertEqual(
+            json.loads(content),
+            [
+                {"name": "мука", "measurement_unit": "г", "amount": 300},
+                {"name": "соль", "measurement_unit": "г", "amount": 3},
+            ],
+        )
+
+    def test_pdf(self):
+        response, content = self.download("pdf")
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(content.startswith(b"%PDF-"))
+        self.assertTrue(content.endswith(b"%%EOF\n"))
+        # Встроено только подмножество шрифта, а не весь файл в сотни КБ
+        self.assertLess(len(content), 64 * 1024)
+        self.assertIn(b"/FontFile2", content)
+
+    def test_empty_cart_and_unknown_format(self):
+        for recipe in self.recipes:
+            response = self.client.delete(f"/api/recipes/{recipe.id}/shopping_cart/")
+            self.assertEqual(response.status_code, 204)
+        _, content = self.download("json")
+        self.assertEqual(json.loads(content), [])
+        response = self.client.get(
+            "/api/recipes/download_shopping_cart/", {"format": "xls"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ShoppingListItemTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.buyer = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="password123"
+        )
+        cls.salt, cls.flour, cls.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("соль", "мука", "сахар")
+        )
+        cls.bread, cls.cake = (
+            Recipe.objects.create(
+                author=cls.author,
+                name=name,
+                image="recipes/test.jpg",
+                text="Описание",
+                cooking_time=10,
+            )
+            for name in ("Хлеб", "Торт")
+        )
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(recipe=cls.bread, ingredient=cls.salt, amount=5),
+                RecipeIngredient(recipe=cls.bread, ingredient=cls.flour, amount=500),
+                RecipeIngredient(recipe=cls.cake, ingredient=cls.flour, amount=300),
+                RecipeIngredient(recipe=cls.cake, ingredient=cls.sugar, amount=200),
+            ]
+        )
+
+    def get_items(self):
+        return dict(
+            ShoppingListItem.objects.filter(user=self.buyer).values_list(
+                "ingredient_id", "total_amount"
+            )
+        )
+
+    def assertItems(self, expected):
+        self.assertEqual(self.get_items(), expected)
+        # Поддерживаемые суммы совпадают с пересчитанными с нуля
+        self.assertEqual(
+            {
+                total["ingredient"]: total["total_amount"]
+                for total in get_shopping_list_totals([self.buyer.id])
+            },
+            expected,
+        )
+
+    def test_items_follow_cart_and_recipe_changes(self):
+        self.client.force_authenticate(self.buyer)
+        for recipe in (self.bread, self.cake):
+            self.client.post(f"/api/recipes/{recipe.id}/shopping_cart/")
+        self.assertItems({self.salt.id: 5, self.flour.id: 800, self.sugar.id: 200})
+
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f"/api/recipes/{self.cake.id}/",
+            {
+                "ingredients": [
+                    {"id": self.flour.id, "amount": 100},
+                    {"id": self.salt.id, "amount": 1},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertItems({self.salt.id: 6, self.flour.id: 600})
+
+        self.client.delete(f"/api/recipes/{self.cake.id}/")
+        self.assertItems({self.salt.id: 5, self.flour.id: 500})
+
+        self.client.force_authenticate(self.buyer)
+        self.client.delete(f"/api/recipes/{self.bread.id}/shopping_cart/")
+        self.assertItems({})
+
+    def test_admin_changes_follow_into_shopping_list(self):
+        self.client.force_authenticate(self.buyer)
+        for recipe in (self.bread, self.cake):
+            self.client.post(f"/api/recipes/{recipe.id}/shopping_cart/")
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password123"
+        )
+        self.client.force_login(admin)
+        data = get_admin_recipe_data(self.cake)
+        # Мука 300 -> 100, сахар удален, добавлена соль
+        ingredients = {
+            data[f"recipe_ingredients-{number}-ingredient"]: number
+            for number in range(2)
+        }
+        data[f"recipe_ingredients-{ingredients[self.flour.id]}-amount"] = 100
+        data[f"recipe_ingredients-{ingredients[self.sugar.id]}-DELETE"] = "on"
+        data.update(
+            {
+                "recipe_ingredients-TOTAL_FORMS": 3,
+                "recipe_ingredients-2-recipe": self.cake.id,
+                "recipe_ingredients-2-ingredient": self.salt.id,
+                "recipe_ingredients-2-amount": 1,
+            }
+        )
+        response = self.client.post(
+            f"/admin/recipes/recipe/{self.cake.id}/change/", data
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertItems({self.salt.id: 6, self.flour.id: 600})
+
+        self.client.force_authenticate(self.buyer)
+        response = self.client.get("/api/recipes/download_shopping_cart/?format=json")
+        self.assertEqual(
+            json.loads(b"".join(response.streaming_content)),
+            [
+                {"name": "мука", "measurement_unit": "г", "amount": 600},
+                {"name": "соль", "measurement_unit": "г", "amount": 6},
+            ],
+        )
+
+        User.objects.filter(pk=self.author.pk).update(recipes_count=2)
+        self.client.force_authenticate(None)
+        self.client.force_login(admin)
+        response = self.client.post(
+            f"/admin/recipes/recipe/{self.cake.id}/delete/", {"post": "yes"}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertItems({self.salt.id: 5, self.flour.id: 500})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_rebuild_command(self):
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.bread)
+        out = io.StringIO()
+        call_command("rebuild_shopping_lists", "--check", stdout=out)
+        self.assertIn(str(self.buyer.id), out.getvalue())
+        call_command("rebuild_shopping_lists", stdout=io.StringIO())
+        self.assertItems({self.salt.id: 5, self.flour.id: 500})
+
+
+class RecipeToggleTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user,
+            name="Рецепт",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=10,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_status_codes(self):
+        for action in ("favorite", "shopping_cart"):
+            url = f"/api/recipes/{self.recipe.id}/{action}/"
+            response = self.client.post(url)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(
+                set(response.data), {"id", "name", "image", "cooking_time"}
+            )
+            self.assertEqual(self.client.post(url).status_code, 400)
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.delete(url).status_code, 400)
+            for missing in ("/api/recipes/0/", "/api/recipes/abc/"):
+                self.assertEqual(
+                    self.client.post(f"{missing}{action}/").status_code, 404
+                )
+                self.assertEqual(
+                    self.client.delete(f"{missing}{action}/").status_code, 404
+                )
+
+    def test_add_is_single_insert(self):
+        # Параллельный запрос уже добавил рецепт: ответ 400, а не 404 или 500
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        self.assertFalse(Favorite.objects.add_recipe(self.user.id, self.recipe.id))
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                ShoppingCart.objects.add_recipe(self.user.id, self.recipe.id)
+            )
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                Favorite.objects.remove_recipe(self.user.id, self.recipe.id)
+            )
+        self.assertEqual(
+            self.client.post(f"/api/recipes/{self.recipe.id}/favorite/").status_code,
+            201,
+        )
+
+    def test_bulk_toggle(self):
+        other = Recipe.objects.create(
+            author=self.user,
+            name="Другой рецепт",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=5,
+        )
+        ingredient = Ingredient.objects.create(name="соль", measurement_unit="г")
+        RecipeIngredient.objects.create(recipe=other, ingredient=ingredient, amount=7)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        data = {"recipes": [self.recipe.id, other.id, other.id, 10**9]}
+        response = self.client.post("/api/recipes/shopping_cart/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(result["id"], result["status"]) for result in response.data["results"]],
+            [(self.recipe.id, 400), (other.id, 201), (10**9, 404)],
+        )
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=self.user, ingredient=ingredient
+            ).total_amount,
+            7,
+        )
+        response = self.client.delete(
+            "/api/recipes/shopping_cart/", {"recipes": [other.id]}, format="json"
+        )
+        self.assertEqual(response.data["results"], [{"id": other.id, "status": 204}])
+        self.assertFalse(ShoppingListItem.objects.filter(user=self.user).exists())
+        self.assertEqual(
+            list(ShoppingCart.objects.values_list("recipe_id", flat=True)),
+            [self.recipe.id],
+        )
+        response = self.client.delete(
+            "/api/recipes/favorite/", {"recipes": [other.id]}, format="json"
+        )
+        self.assertEqual(response.data["results"][0]["status"], 400)
+        for data in ({}, {"recipes": []}, {"recipes": [0]}):
+            response = self.client.post("/api/recipes/favorite/", data, format="json")
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CounterTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.reader = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        cls.ingredient = Ingredient.objects.create(name="соль", measurement_unit="г")
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def create_recipe(self):
+        response = self.client.post(
+            "/api/recipes/",
+            {
+                "name": "Рецепт",
+                "text": "Описание",
+                "cooking_time": 5,
+                "image": make_image(),
+                "ingredients": [{"id": self.ingredient.id, "amount": 1}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.data["id"])
+
+    def assertCounters(self, recipe, favorites, carts, recipes, subscribers):
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (
+                recipe.favorites_count,
+                recipe.in_carts_count,
+                self.author.recipes_count,
+                self.author.subscribers_count,
+            ),
+            (favorites, carts, recipes, subscribers),
+        )
+
+    def test_write_paths_update_counters(self):
+        recipe = self.create_recipe()
+        other = self.create_recipe()
+        self.assertCounters(recipe, 0, 0, 2, 0)
+
+        self.client.force_authenticate(self.reader)
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        self.client.post(f"/api/recipes/{recipe.id}/shopping_cart/")
+        self.client.post(f"/api/users/{self.author.id}/subscribe/")
+        self.assertCounters(recipe, 1, 1, 2, 1)
+        self.client.post(
+            "/api/recipes/favorite/", {"recipes": [recipe.id, other.id]}, format="json"
+        )
+        self.assertCounters(other, 1, 0, 2, 1)
+
+        self.client.delete(f"/api/recipes/{recipe.id}/favorite/")
+        self.client.delete(
+            "/api/recipes/shopping_cart/", {"recipes": [recipe.id]}, format="json"
+        )
+        self.client.delete(f"/api/users/{self.author.id}/subscribe/")
+        self.client.delete(f"/api/users/{self.author.id}/subscribe/")
+        self.assertCounters(recipe, 0, 0, 2, 0)
+
+        self.client.force_authenticate(self.author)
+        self.client.delete(f"/api/recipes/{other.id}/")
+        self.assertCounters(recipe, 0, 0, 1, 0)
+
+    def test_user_deletion_updates_counters(self):
+        recipe = self.create_recipe()
+        self.client.force_authenticate(self.reader)
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        self.client.post(f"/api/recipes/{recipe.id}/shopping_cart/")
+        self.client.post(f"/api/users/{self.author.id}/subscribe/")
+        self.assertCounters(recipe, 1, 1, 1, 1)
+        self.reader.delete()
+        self.assertCounters(recipe, 0, 0, 1, 0)
+        self.assertEqual(recipe.popularity, 0)
+
+        cook = User.objects.create_user(
+            username="cook", email="cook@example.com", password="password123"
+        )
+        self.client.force_authenticate(cook)
+        self.client.post(f"/api/recipes/{recipe.id}/shopping_cart/")
+        self.assertTrue(ShoppingListItem.objects.filter(user=cook).exists())
+        # Рецепты удаленного автора уходят и из чужих списков покупок
+        self.author.delete()
+        self.assertFalse(ShoppingListItem.objects.filter(user=cook).exists())
+        out = io.StringIO()
+        call_command("reconcile_counters", "--check", stdout=out)
+        self.assertNotIn("расхождения у", out.getvalue())
+
+    def test_admin_changes_update_counters(self):
+        recipe = self.create_recipe()
+        admin_user = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password123"
+        )
+        self.client.force_login(admin_user)
+        for path, data in (
+            ("recipes/favorite", {"user": self.reader.id, "recipe": recipe.id}),
+            ("recipes/shoppingcart", {"user": self.reader.id, "recipe": recipe.id}),
+            (
+                "users/subscription",
+                {"user": self.reader.id, "subscriber": self.author.id},
+            ),
+        ):
+            response = self.client.post(f"/admin/{path}/add/", data)
+            self.assertEqual(response.status_code, 302)
+        self.assertCounters(recipe, 1, 1, 1, 1)
+        self.assertTrue(ShoppingListItem.objects.filter(user=self.reader).exists())
+
+        favorite = Favorite.objects.get()
+        response = self.client.post(
+            f"/admin/recipes/favorite/{favorite.id}/delete/", {"post": "yes"}
+        )
+        self.assertEqual(response.status_code, 302)
+        for path, model in (
+            ("recipes/shoppingcart", ShoppingCart),
+            ("users/subscription", Subscription),
+        ):
+            response = self.client.post(
+                f"/admin/{path}/",
+                {
+                    "action": "delete_selected",
+                    "_selected_action": list(
+                        model.objects.values_list("id", flat=True)
+                    ),
+                    "post": "yes",
+                },
+            )
+            self.assertEqual(response.status_code, 302)
+        self.assertCounters(recipe, 0, 0, 1, 0)
+        self.assertEqual(recipe.popularity, 0)
+        self.assertFalse(ShoppingListItem.objects.filter(user=self.reader).exists())
+
+    def test_reconcile_counters(self):
+        recipe = self.create_recipe()
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        User.objects.filter(pk=self.author.pk).update(subscribers_count=5)
+        out = io.StringIO()
+        call_command("reconcile_counters", "--check", stdout=out)
+        self.assertIn("favorites_count: найдены расхождения у 1 строк", out.getvalue())
+        self.assertCounters(recipe, 0, 0, 1, 5)
+        call_command("reconcile_counters", "--batch-size", "1", stdout=io.StringIO())
+        self.assertCounters(recipe, 1, 0, 1, 0)
+        out = io.StringIO()
+        call_command("reconcile_counters", "--check", stdout=out)
+        self.assertNotIn("расхождения у", out.getvalue())
+
+
+class PopularRecipesTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        cls.recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user,
+                name=f"Рецепт {number}",
+                image="recipes/test.jpg",
+                text="Описание",
+                cooking_time=10,
+                popularity=popularity,
+            )
+            for number, popularity in enumerate((0, 2.5, 1, 1, 1, 0, 4))
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_follow_popularity_then_id(self):
+        expected = [
+            recipe.id
+            for recipe in sorted(
+                self.recipes,
+                key=lambda recipe: (recipe.popularity, recipe.id),
+                reverse=True,
+            )
+        ]
+        ids = []
+        url = "/api/recipes/popular/?limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            ids += [recipe["id"] for recipe in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, expected)
+        ids = []
+        url = "/api/recipes/?ordering=popular&limit=3"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            # Тот же курсор, что у /popular/: без COUNT(*) и OFFSET
+            self.assertNotIn("count", response.data)
+            self.assertFalse(any("OFFSET" in query["sql"].upper() for query in queries))
+            ids += [recipe["id"] for recipe in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, expected)
+        response = self.client.get("/api/recipes/popular/?cursor=bad")
+        self.assertEqual(response.status_code, 404)
+
+    def test_favorites_and_decay_change_popularity(self):
+        recipe = self.recipes[0]
+        self.client.force_authenticate(self.user)
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.popularity, 1)
+        call_command(
+            "decay_popularity",
+            "--hours",
+            "24",
+            "--half-life-days",
+            "1",
+            stdout=io.StringIO(),
+        )
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.popularity, 0.5)
+        self.client.delete(f"/api/recipes/{recipe.id}/favorite/")
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.popularity, 0)
+        call_command("decay_popularity", "--rebuild", stdout=io.StringIO())
+        self.assertEqual(
+            list(Recipe.objects.filter(popularity__gt=0).values_list("id", flat=True)),
+            [],
+        )
+
+    @override_settings(POPULARITY_HALF_LIFE_DAYS=7)
+    def test_unfavorite_subtracts_decayed_contribution(self):
+        recipe = self.recipes[0]
+        reader = User.objects.create_user(
+            username="other", email="other@example.com", password="password123"
+        )
+        self.client.force_authenticate(self.user)
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        # Добавление неделю назад, с тех пор популярность затухла вдвое
+        Favorite.objects.filter(user=self.user).update(
+            created_at=timezone.now() - timezone.timedelta(days=7)
+        )
+        call_command("decay_popularity", "--hours", "168", stdout=io.StringIO())
+        self.client.force_authenticate(reader)
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        recipe.refresh_from_db()
+        self.assertAlmostEqual(recipe.popularity, 1.5)
+        self.client.force_authenticate(self.user)
+        self.client.delete(f"/api/recipes/{recipe.id}/favorite/")
+        recipe.refresh_from_db()
+        self.assertAlmostEqual(recipe.popularity, 1, places=4)
+        self.client.force_authenticate(reader)
+        response = self.client.delete(
+            "/api/recipes/favorite/", {"recipes": [recipe.id]}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertAlmostEqual(recipe.popularity, 0, places=4)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeImageVariantTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.ingredient = Ingredient.objects.create(name="соль", measurement_unit="г")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self):
+        response = self.client.post(
+            "/api/recipes/",
+            {
+                "name": "Рецепт",
+                "text": "Описание",
+                "cooking_time": 5,
+                "image": make_image(),
+                "ingredients": [{"id": self.ingredient.id, "amount": 1}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.data["id"])
+
+    def test_variants_are_made_off_request(self):
+        recipe = self.create_recipe()
+        self.assertEqual(recipe.image_variants, {})
+        self.assertEqual(recipe.image_task.image, recipe.image.name)
+        response = self.client.get("/api/recipes/")
+        self.assertTrue(response.data["results"][0]["image"].endswith(".png"))
+
+        call_command("process_images", "--once", "--workers", "1", stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertFalse(RecipeImageTask.objects.exists())
+        self.assertEqual(set(recipe.image_variants), set(settings.IMAGE_VARIANTS))
+        for formats in recipe.image_variants.values():
+            self.assertEqual(set(formats), {"webp", "jpeg"})
+            for name in formats.values():
+                self.assertTrue(default_storage.exists(name))
+
+        small = recipe.image_variants["small"]["jpeg"]
+        response = self.client.get("/api/recipes/")
+        self.assertTrue(response.data["results"][0]["image"].endswith(small))
+        response = self.client.get(f"/api/recipes/{recipe.id}/")
+        self.assertTrue(response.data["image"].endswith(recipe.image.name))
+        self.assertTrue(
+            response.data["image_variants"]["medium"]["jpeg"].startswith("http")
+        )
+        response = self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        self.assertTrue(response.data["image"].endswith(small))
+
+    def test_variants_reach_warm_cache_of_other_process(self):
+        recipe = self.create_recipe()
+        url = f"/api/recipes/{recipe.id}/"
+        etag = self.client.get(url)["ETag"]
+        self.client.get("/api/recipes/")
+        task = RecipeImageTask.objects.get(recipe=recipe)
+        variants, error = run_image_task(task.image)
+        self.assertIsNone(error)
+        # Обработчик работает в другом процессе и не может сбросить кэш
+        # этого процесса
+        with mock.patch("recipes.images.invalidate_recipes"):
+            complete_image_task(task, variants)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(set(response.data["image_variants"]), set(variants))
+        response = self.client.get("/api/recipes/")
+        self.assertTrue(
+            response.data["results"][0]["image"].endswith(variants["small"]["jpeg"])
+        )
+
+    def test_admin_image_change_enqueues_variants(self):
+        recipe = self.create_recipe()
+        call_command("process_images", "--once", "--workers", "1", stdout=io.StringIO())
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password123"
+        )
+        self.client.force_login(admin)
+        image = ContentFile(
+            base64.b64decode(make_image().split(",", 1)[1]), name="new.png"
+        )
+        response = self.client.post(
+            f"/admin/recipes/recipe/{recipe.id}/change/",
+            get_admin_recipe_data(recipe, image=image),
+        )
+        self.assertEqual(response.status_code, 302)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+        self.assertEqual(recipe.image_task.image, recipe.image.name)
+
+    def test_new_image_resets_variants(self):
+        recipe = self.create_recipe()
+        call_command("process_images", "--once", "--workers", "1", stdout=io.StringIO())
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/",
+            {
+                "image": make_image(),
+                "ingredients": [{"id": self.ingredient.id, "amount": 1}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+        self.assertEqual(recipe.image_task.image, recipe.image.name)
+
+    def test_failed_task_is_retried_later(self):
+        recipe = self.create_recipe()
+        RecipeImageTask.objects.filter(recipe=recipe).update(
+            image="recipes/missing.png"
+        )
+        with self.assertLogs("foodgram.images", "WARNING"):
+            call_command(
+                "process_images", "--once", "--workers", "1", stdout=io.StringIO()
+            )
+        task = RecipeImageTask.objects.get(recipe=recipe)
+        self.assertEqual(task.attempts, 1)
+        self.assertIsNotNone(task.locked_until)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaGarbageTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_only_unreferenced_old_files_are_removed(self):
+        users = [
+            User.objects.create_user(
+                username=f"user{number}",
+                email=f"user{number}@example.com",
+                password="password123",
+            )
+            for number in range(2)
+        ]
+        avatar = make_image()
+        for user in users:
+            self.client.force_authenticate(user)
+            response = self.client.put(
+                "/api/users/me/avatar/", {"avatar": avatar}, format="json"
+            )
+            self.assertEqual(response.status_code, 200)
+        users[0].refresh_from_db()
+        shared = users[0].avatar.name
+        self.assertEqual(User.objects.filter(avatar=shared).count(), 2)
+        # Удаление аватара у одного пользователя не трогает общий файл
+        self.assertEqual(self.client.delete("/api/users/me/avatar/").status_code, 204)
+        self.assertTrue(default_storage.exists(shared))
+
+        orphan = default_storage.save("recipes/orphan.png", ContentFile(b"orphan"))
+        fresh = default_storage.save("recipes/fresh.png", ContentFile(b"fresh"))
+        old = time.time() - 2 * 24 * 3600
+        for name in (shared, orphan):
+            os.utime(default_storage.path(name), (old, old))
+
+        out = io.StringIO()
+        call_command("collect_media_garbage", "--dry-run", stdout=out)
+        self.assertIn("Будет удалено файлов: 1", out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
+        call_command("collect_media_garbage", stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(shared))
+        self.assertTrue(default_storage.exists(fresh))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageUploadTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.ingredient = Ingredient.objects.create(name="соль", measurement_unit="г")
+        cls.content = base64.b64decode(make_image().split(",", 1)[1])
+
+    def setUp(self):
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        settings_override = self.settings(IMAGE_UPLOAD_DIR=upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_authenticate(self.user)
+
+    def send_part(self, token, offset, part):
+        return self.client.generic(
+            "PATCH",
+            f"/api/uploads/{token}/",
+            part,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def upload(self, content):
+        response = self.client.post(
+            "/api/uploads/", {"size": len(content)}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        token = response.data["token"]
+        for offset in range(0, len(content), 20):
+            response = self.send_part(token, offset, content[offset : offset + 20])
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["offset"], len(content))
+        return token
+
+    def test_parts_resume_from_offset(self):
+        response = self.client.post(
+            "/api/uploads/", {"size": len(self.content)}, format="json"
+        )
+        token = response.data["token"]
+        self.assertEqual(self.send_part(token, 0, self.content[:30]).status_code, 200)
+        # Повтор уже принятой части не дописывает ее второй раз
+        response = self.send_part(token, 0, self.content[:30])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["offset"], 30)
+        self.assertEqual(self.client.get(f"/api/uploads/{token}/").data["offset"], 30)
+        response = self.send_part(token, 30, self.content[30:] + b"extra")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            "/api/uploads/",
+            {"size": settings.MAX_IMAGE_UPLOAD_SIZE + 1},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.generic(
+            "PATCH", f"/api/uploads/{token}/", b"", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 415)
+
+        other = User.objects.create_user(
+            username="other", email="other@example.com", password="password123"
+        )
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f"/api/uploads/{token}/").status_code, 404)
+
+    def test_line_wrapped_base64(self):
+        # encodebytes разбивает base64 на строки по 76 символов
+        avatar = "data:image/png;base64," + base64.encodebytes(self.content).decode()
+        self.assertIn("\n", avatar.rstrip("\n"))
+        response = self.client.put(
+            "/api/users/me/avatar/", {"avatar": avatar}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        with self.user.avatar.open() as file:
+            self.assertEqual(file.read(), self.content)
+
+    def test_token_replaces_base64(self):
+        recipe_data = {
+            "name": "Рецепт",
+            "text": "Описание",
+            "cooking_time": 5,
+            "image": self.upload(self.content),
+            "ingredients": [{"id": self.ingredient.id, "amount": 1}],
+        }
+        response = self.client.post("/api/recipes/", recipe_data, format="json")
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        self.assertTrue(recipe.image.name.endswith(".png"))
+        with recipe.image.open() as file:
+            self.assertEqual(file.read(), self.content)
+        # Файл загрузки перемещен в хранилище, повторно токен не принимается
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_DIR), [])
+        response = self.client.post("/api/recipes/", recipe_data, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("image", response.data)
+
+        # Такая же картинка уже есть в хранилище: файл загрузки удаляется
+        response = self.client.put(
+            "/api/users/me/avatar/",
+            {"avatar": self.upload(self.content)},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(
+            self.user.avatar.name.rsplit("/", 1)[-1],
+            recipe.image.name.rsplit("/", 1)[-1],
+        )
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_DIR), [])
+
+        response = self.client.put(
+            "/api/users/me/avatar/",
+            {"avatar": self.upload(b"not an image" * 10)},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_abandoned_uploads_are_purged(self):
+        response = self.client.post("/api/uploads/", {"size": 100}, format="json")
+        token = response.data["token"]
+        self.send_part(token, 0, b"x" * 10)
+        fresh = self.client.post("/api/uploads/", {"size": 100}, format="json")
+        orphan = os.path.join(settings.IMAGE_UPLOAD_DIR, "orphan.part")
+        with open(orphan, "wb") as file:
+            file.write(b"x")
+        old = time.time() - 2 * 24 * 3600
+        for name in (f"{token}.part", "orphan.part"):
+            os.utime(os.path.join(settings.IMAGE_UPLOAD_DIR, name), (old, old))
+
+        call_command("collect_media_garbage", stdout=io.StringIO())
+        self.assertEqual(
+            list(ImageUpload.objects.values_list("token", flat=True)),
+            [uuid.UUID(fresh.data["token"])],
+        )
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_DIR), [])
+
+
+class ShortLinkTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        cls.recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user,
+                name=f"Рецепт {i}",
+                image="recipes/test.jpg",
+                text="Описание",
+                cooking_time=5,
+            )
+            for i in range(3)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_redirect_is_served_from_cache(self):
+        recipe = self.recipes[0]
+        self.assertRegex(recipe.short_code, r"^[0-9A-Za-z]{8}$")
+        response = self.client.get(f"/api/recipes/{recipe.id}/get-link/")
+        self.assertEqual(
+            response.data["short-link"], f"http://testserver/s/{recipe.short_code}/"
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/s/{recipe.short_code}/")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], f"/recipes/{recipe.id}/")
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/s/{recipe.short_code}")
+        self.assertEqual(response.status_code, 302)
+
+        # Несуществующие коды не занимают место в кэше
+        self.assertEqual(self.client.get("/s/00000000/").status_code, 404)
+        self.assertEqual(self.client.get("/s/bad-code/").status_code, 404)
+        self.assertIsNone(cache.get(short_code_cache_key("00000000")))
+        self.assertEqual(self.client.get("/api/recipes/0/get-link/").status_code, 404)
+
+    def test_deleted_recipe_link_stops_working(self):
+        recipe = self.recipes[1]
+        self.assertEqual(self.client.get(f"/s/{recipe.short_code}/").status_code, 302)
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f"/api/recipes/{recipe.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(f"/s/{recipe.short_code}/").status_code, 404)
+
+    def test_backfill(self):
+        Recipe.objects.update(short_code=None)
+        recipe = self.recipes[0]
+        response = self.client.get(f"/api/recipes/{recipe.id}/get-link/")
+        self.assertEqual(
+            response.data["short-link"], f"http://testserver/recipes/{recipe.id}/"
+        )
+        out = io.StringIO()
+        call_command("backfill_short_codes", "--batch-size", "2", stdout=out)
+        self.assertIn("Заполнено кодов: 3", out.getvalue())
+        codes = set(Recipe.objects.values_list("short_code", flat=True))
+        self.assertEqual(len(codes), 3)
+        self.assertNotIn(None, codes)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SeedCommandTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_seed(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {number}", measurement_unit="г")
+            for number in range(3)
+        )
+        out = io.StringIO()
+        call_command(
+            "commands",
+            "--users",
+            "4",
+            "--recipes",
+            "6",
+            "--ingredients-per-recipe",
+            "2",
+            "--favorite-density",
+            "0.5",
+            "--cart-density",
+            "0.5",
+            "--workers",
+            "1",
+            stdout=out,
+        )
+        self.assertIn("Успешно создано 4", out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 6)
+        self.assertEqual(Favorite.objects.count(), 12)
+        self.assertEqual(ShoppingCart.objects.count(), 12)
+        self.assertFalse(Favorite.objects.filter(created_at__isnull=True).exists())
+        self.assertEqual(
+            sum(Recipe.objects.values_list("favorites_count", flat=True)), 12
+        )
+        self.assertTrue(ShoppingListItem.objects.exists())
+
+
+# Бенчмарк обращается к API с заголовком Host: localhost
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ALLOWED_HOSTS=["localhost"])
+class BenchmarkCommandTest(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_benchmark(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {number}", measurement_unit="г")
+            for number in range(3)
+        )
+        with self.assertRaisesMessage(CommandError, "не меньше 2 запросов"):
+            call_command("benchmark", "--requests", "1", stdout=io.StringIO())
+        output = os.path.join(settings.MEDIA_ROOT, "benchmark.json")
+        call_command(
+            "benchmark",
+            *("--users", "3", "--recipes", "6", "--ingredients-per-recipe", "2"),
+            *("--requests", "2", "--output", output),
+            stdout=io.StringIO(),
+        )
+        with open(output, encoding="utf-8") as file:
+            results = json.load(file)["results"]
+        self.assertEqual(results["recipe-detail"]["requests"], 2)
+        self.assertEqual(results["recipe-detail"]["status_codes"], {"200": 2})
+        self.assertFalse(Recipe.objects.exists())
+
+
+class RecipeToggleRaceTest(APITransactionTestCase):
+    """Нужна настоящая фиксация: SQLite проверяет внешние ключи при ней."""
+
+    def test_recipe_deleted_while_adding(self):
+        user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        recipe = Recipe.objects.create(
+            author=user,
+            name="Рецепт",
+            image="recipes/test.jpg",
+            text="Описание",
+            cooking_time=5,
+        )
+        self.client.force_authenticate(user)
+
+        def get_and_delete(queryset, **kwargs):
+            found = get_object_or_404(queryset, **kwargs)
+            Recipe.objects.filter(pk=found.pk).delete()
+            return found
+
+        for action in ("favorite", "shopping_cart"):
+            with mock.patch("recipes.views.get_object_or_404", get_and_delete):
+                response = self.client.post(f"/api/recipes/{recipe.id}/{action}/")
+            self.assertEqual(response.status_code, 404)
+            recipe.save(force_insert=True)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(ShoppingCart.objects.exists())
@@ -0,0 +1,118 @@
+import fcntl
+import os
+import time
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from .models import ImageUpload
+
+# Размер куска при чтении тела запроса
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """Смещение части не совпадает с загруженным объемом или файл занят."""
+
+
+class UploadTooLarge(Exception):
+    """Часть выходит за объявленный размер загрузки."""
+
+
+class UploadedPart(UploadedFile):
+    """
+    Файл завершенной загрузки. Хранилище перемещает его в MEDIA_ROOT
+    по temporary_file_path, как TemporaryUploadedFile, без копирования.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_upload_path(upload):
+    return os.path.join(settings.IMAGE_UPLOAD_DIR, f"{upload.token.hex}.part")
+
+
+def get_upload_offset(upload):
+    """Загруженный объем: размер файла загрузки."""
+    try:
+        return os.path.getsize(get_upload_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def append_to_upload(upload, offset, stream):
+    """
+    Дописывает тело запроса stream в файл загрузки с позиции offset
+    кусками по CHUNK_SIZE. Возвращает новый загруженный объем.
+
+    Файл блокируется flock, а не строкой в БД: транзакция не держится,
+    пока медленный клиент передает часть. Если соединение оборвется,
+    уже записанные байты сохранятся и клиент продолжит с них.
+    """
+    os.makedirs(settings.IMAGE_UPLOAD_DIR, exist_ok=True)
+    with open(get_upload_path(upload), "ab") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict
+        position = file.seek(0, os.SEEK_END)
+        if position != offset:
+            raise UploadConflict
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                return position
+            if position + len(chunk) > upload.size:
+                raise UploadTooLarge
+            file.write(chunk)
+            position += len(chunk)
+
+
+def open_upload(user, token):
+    """
+    Открывает завершенную загрузку пользователя. Возвращает None, если
+    загрузки нет или она еще не завершена.
+    """
+    upload = ImageUpload.objects.filter(user=user, token=token).first()
+    if upload is None or get_upload_offset(upload) != upload.size:
+        return None
+    return UploadedPart(open(get_upload_path(upload), "rb"), size=upload.size)
+
+
+def delete_upload(upload):
+    try:
+        os.remove(get_upload_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge_uploads(max_age, dry_run=False):
+    """
+    Удаляет загрузки, файлы которых не менялись дольше max_age секунд,
+    в том числе уже использованные: их файлы хранилище забрало
+    в MEDIA_ROOT. Файлы без загрузок в БД тоже удаляются.
+    Возвращает число удаленных загрузок и файлов.
+    """
+    oldest = time.time() - max_age
+    removed = 0
+    tokens = set()
+    for upload in ImageUpload.objects.iterator():
+        tokens.add(upload.token.hex)
+        try:
+            modified = os.path.getmtime(get_upload_path(upload))
+        except FileNotFoundError:
+            modified = upload.created_at.timestamp()
+        if modified > oldest:
+            continue
+        if not dry_run:
+            delete_upload(upload)
+        removed += 1
+    if os.path.isdir(settings.IMAGE_UPLOAD_DIR):
+        for entry in os.scandir(settings.IMAGE_UPLOAD_DIR):
+            token = entry.name.split(".")[0]
+            if token in tokens or entry.stat().st_mtime > oldest:
+                continue
+            if not dry_run:
+                os.remove(entry.path)
+            removed += 1
+    return removed
@@ -1,10 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RecipeViewSet
-
+from .views import ImageUploadViewSet, RecipeViewSet
 
 router = DefaultRouter()
 router.register(r"recipes", RecipeViewSet)
+router.register(r"uploads", ImageUploadViewSet, basename="upload")
 
 urlpatterns = [
     path("", include(router.urls)),
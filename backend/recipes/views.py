@@ -1,5 +1,5 @@
-from django.db.models import Sum
-from rest_framework import viewsets, status
+import io
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import (
     IsAuthenticated,
@@ -7,21 +7,66 @@ from rest_framework.permissions import (
     AllowAny,
 )
 from rest_framework.response import Response
-from django.http import HttpResponse
-from rest_framework.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from rest_framework.exceptions import (
+    PermissionDenied,
+    UnsupportedMediaType,
+    ValidationError,
+)
 from django.shortcuts import get_object_or_404
-from .models import Recipe, Favorite, ShoppingCart, RecipeIngredient
-from .serializers import RecipeSerializer, RecipeShortSerializer
+from foodgram_backend.pagination import RecipePagination, RecipePopularPagination
+from utils.http import conditional_response, make_etag, set_validators
+from .cache import RECIPE_CACHE_VERSION, invalidate_recipes, resolve_short_code
+from .counters import change_recipe_counters, delete_recipe
+from .models import ImageUpload, Recipe, Favorite, ShoppingCart
+from .serializers import (
+    ImageUploadSerializer,
+    RecipeIdsSerializer,
+    RecipeSerializer,
+    RecipeShortSerializer,
+)
+from .shopping_list import (
+    EXPORTERS,
+    CSVRenderer,
+    PDFRenderer,
+    ShoppingListJSONRenderer,
+    TextRenderer,
+    change_recipes_in_shopping_lists,
+    get_shopping_list,
+)
+from .uploads import (
+    UploadConflict,
+    UploadTooLarge,
+    append_to_upload,
+    delete_upload,
+    get_upload_offset,
+)
+
+# Тип тела запроса с частью загрузки, как в протоколе tus
+UPLOAD_CONTENT_TYPE = "application/offset+octet-stream"
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = RecipePagination
+    # Нечисловой id не доходит до запросов к БД, а сразу дает 404
+    lookup_value_regex = r"\d+"
+    # Ответы содержат флаги текущего пользователя
+    vary_headers = ("Authorization",)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        version = (instance.pk, instance.updated_at)
+        with transaction.atomic():
+            delete_recipe(instance)
+        invalidate_recipes([version])
+
     def get_object(self):
         """
         Переопределяем метод получения объекта для проверки прав доступа при обновлении.
@@ -30,189 +75,377 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         if (
             self.request.method in ["PATCH", "PUT", "DELETE"]
-            and obj.author != self.request.user
+            and obj.author_id != self.request.user.id
         ):
             raise PermissionDenied("У вас нет прав для редактирования этого рецепта")
 
         return obj
 
-    def update(self, request, *args, **kwargs):
-        """
-        Переопределяем метод обновления для явной проверки авторства.
-        """
-        pk = kwargs.get("pk")
-
-        recipe_exists = Recipe.objects.filter(pk=pk).exists()
-
-        if not recipe_exists:
-            return Response(
-                {"detail": "No Recipe matches the given query."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-
-        instance = Recipe.objects.get(pk=pk)
-        if instance.author != request.user:
-            return Response(
-                {"detail": "У вас нет прав для редактирования этого рецепта"},
-                status=status.HTTP_403_FORBIDDEN,
-            )
-
-        return super().update(request, *args, **kwargs)
-
-    def partial_update(self, request, *args, **kwargs):
-        """
-        Переопределяем метод частичного обновления для явной проверки авторства.
-        """
-        pk = kwargs.get("pk")
-
-        recipe_exists = Recipe.objects.filter(pk=pk).exists()
-
-        if not recipe_exists:
-
-            return Response(
-                {"detail": "No Recipe matches the given query."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-
-        instance = Recipe.objects.get(pk=pk)
-        if instance.author != request.user:
-            return Response(
-                {"detail": "У вас нет прав для редактирования этого рецепта"},
-                status=status.HTTP_403_FORBIDDEN,
-            )
-
-        return super().partial_update(request, *args, **kwargs)
-
     def get_queryset(self):
-        queryset = Recipe.objects.all()
+        queryset = Recipe.objects.with_user_flags(self.request.user)
         is_favorited = self.request.query_params.get("is_favorited")
         is_in_shopping_cart = self.request.query_params.get("is_in_shopping_cart")
         author_id = self.request.query_params.get("author")
+        search = self.request.query_params.get("search")
+        ordering = self.request.query_params.get("ordering")
+        ingredient_ids = self.get_ingredient_ids()
         if is_favorited == "1" and self.request.user.is_authenticated:
-            queryset = queryset.filter(favorite__user=self.request.user)
+            queryset = queryset.filter(is_favorited=True)
         if is_in_shopping_cart == "1" and self.request.user.is_authenticated:
-            queryset = queryset.filter(shopping_cart__user=self.request.user)
+            queryset = queryset.filter(is_in_shopping_cart=True)
         if author_id:
             queryset = queryset.filter(author_id=author_id)
+        if ingredient_ids:
+            queryset = queryset.with_ingredients(
+                ingredient_ids,
+                match_all=self.request.query_params.get("ingredients_match") != "any",
+            )
+        if search:
+            queryset = queryset.search(search)
+        if ordering == "popular" or self.action == "popular":
+            queryset = queryset.order_by(*RecipePopularPagination.ordering)
+        if self.action in ("list", "retrieve", "popular"):
+            # Остальные поля сериализатор берет из кэша представлений рецептов
+            queryset = queryset.only(
+                "id", "author", "created_at", "updated_at", "popularity"
+            )
         return queryset
 
-    @action(
-        detail=True, methods=["post", "delete"], permission_classes=[IsAuthenticated]
-    )
-    def favorite(self, request, pk=None):
-        if request.method == "POST":
-            try:
-
-                recipe = get_object_or_404(Recipe, pk=pk)
+    def get_ingredient_ids(self):
+        """Id ингредиентов из ?ingredients=1,2 или ?ingredients=1&ingredients=2."""
+        values = self.request.query_params.getlist("ingredients")
+        try:
+            return [
+                int(value)
+                for item in values
+                for value in item.split(",")
+                if value.strip()
+            ]
+        except ValueError:
+            raise ValidationError(
+                {"ingredients": "Ингредиенты задаются списком id через запятую."}
+            )
 
-                favorite_exists = request.user.favorites.filter(recipe=recipe).exists()
-                if favorite_exists:
-                    return Response(
-                        {"errors": "Рецепт уже в избранном"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
+    @staticmethod
+    def get_recipe_version(recipe):
+        """Значения, от которых зависит представление рецепта для пользователя."""
+        return (
+            recipe.pk,
+            recipe.updated_at,
+            recipe.is_favorited,
+            recipe.is_in_shopping_cart,
+            recipe.is_subscribed_to_author,
+        )
 
-                Favorite.objects.create(user=request.user, recipe=recipe)
-                serializer = RecipeShortSerializer(recipe, context={"request": request})
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            except:
-                return Response(
-                    {"detail": "No Recipe matches the given query."},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
+    def list(self, request, *args, **kwargs):
+        """
+        Список рецептов с ETag по странице: id, updated_at и флаги
+        пользователя известны до сериализации, поэтому на If-None-Match
+        отвечаем 304, не собирая тело ответа.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        recipes = page if page is not None else list(queryset)
+        # Счетчик и ссылки пагинации без сериализации самих рецептов
+        envelope = self.get_paginated_response([]).data if page is not None else {}
+        etag = make_etag(
+            RECIPE_CACHE_VERSION,
+            [(key, value) for key, value in envelope.items() if key != "results"],
+            [self.get_recipe_version(recipe) for recipe in recipes],
+        )
+        not_modified = conditional_response(request, etag, vary=self.vary_headers)
+        if not_modified is not None:
+            return not_modified
+
+        serializer = self.get_serializer(recipes, many=True)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        return set_validators(response, etag, vary=self.vary_headers)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = make_etag(RECIPE_CACHE_VERSION, self.get_recipe_version(instance))
+        # Для анонимных пользователей ответ зависит только от самого рецепта
+        last_modified = None if request.user.is_authenticated else instance.updated_at
+        not_modified = conditional_response(
+            request, etag, last_modified, vary=self.vary_headers
+        )
+        if not_modified is not None:
+            return not_modified
 
-        if request.method == "DELETE":
-            try:
+        serializer = self.get_serializer(instance)
+        return set_validators(
+            Response(serializer.data), etag, last_modified, vary=self.vary_headers
+        )
 
-                recipe = get_object_or_404(Recipe, pk=pk)
+    @action(detail=False, pagination_class=RecipePopularPagination)
+    def popular(self, request):
+        """
+        Рецепты по убыванию популярности: числа добавлений в избранное
+        с затуханием. Страницы выбираются по индексу без OFFSET и COUNT(*).
+        """
+        return self.list(request)
 
-                favorite = request.user.favorites.filter(recipe=recipe)
-                if not favorite.exists():
+    def add_recipe_to(self, model, error, after_change=None):
+        """
+        Добавляет рецепт в избранное или список покупок: 404, если рецепта
+        нет (в том числе если его удалили во время добавления), 400, если
+        он уже добавлен, иначе 201 с кратким рецептом.
+        """
+        recipe = get_object_or_404(
+            Recipe.objects.only(
+                "id", "name", "image", "image_variants", "cooking_time"
+            ),
+            pk=self.kwargs["pk"],
+        )
+        user_id = self.request.user.id
+        try:
+            with transaction.atomic(savepoint=False):
+                if not model.objects.add_recipe(user_id, recipe.pk):
                     return Response(
-                        {"errors": "Рецепт не в избранном"},
-                        status=status.HTTP_400_BAD_REQUEST,
+                        {"errors": error}, status=status.HTTP_400_BAD_REQUEST
                     )
-
-                favorite.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            except:
-                return Response(
-                    {"detail": "No Recipe matches the given query."},
-                    status=status.HTTP_404_NOT_FOUND,
+                change_recipe_counters(model, [recipe.pk], 1)
+                if after_change is not None:
+                    after_change([recipe.pk], [user_id])
+        except IntegrityError:
+            # Рецепт удален параллельным запросом после проверки
+            raise Http404
+        serializer = RecipeShortSerializer(recipe, context={"request": self.request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def remove_recipe_from(self, model, error, after_change=None):
+        """
+        Удаляет рецепт из избранного или списка покупок одним DELETE.
+        Существование рецепта проверяется, только если удалять было нечего.
+        """
+        recipe_id = int(self.kwargs["pk"])
+        user_id = self.request.user.id
+        with transaction.atomic(savepoint=False):
+            removed = model.objects.remove_recipes(user_id, [recipe_id])
+            if removed:
+                change_recipe_counters(model, removed, -1)
+            if removed and after_change is not None:
+                after_change([recipe_id], [user_id], sign=-1)
+        if not removed:
+            get_object_or_404(Recipe.objects.only("id"), pk=recipe_id)
+            return Response({"errors": error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def change_recipes_in(self, model, error, after_change=None):
+        """
+        Массовое добавление (POST) или удаление (DELETE) рецептов из тела
+        {"recipes": [id, ...]} двумя запросами: рецепты с флагом наличия
+        связи, затем один INSERT ... ON CONFLICT DO NOTHING или DELETE
+        с RETURNING, чтобы счетчики и списки покупок менялись только
+        для действительно измененных связей.
+        Для каждого id возвращается статус, как у запроса на один рецепт.
+        """
+        serializer = RecipeIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+        user_id = self.request.user.id
+        adding = self.request.method == "POST"
+        linked = dict(
+            Recipe.objects.filter(pk__in=recipe_ids)
+            .annotate(
+                linked=Exists(
+                    model.objects.filter(user_id=user_id, recipe_id=OuterRef("pk"))
                 )
+            )
+            .values_list("id", "linked")
+            .order_by()
+        )
+        candidates = [
+            recipe_id
+            for recipe_id in recipe_ids
+            if recipe_id in linked and linked[recipe_id] != adding
+        ]
+        sign = 1 if adding else -1
+        with transaction.atomic(savepoint=False):
+            if adding:
+                changed = model.objects.add_recipes(user_id, candidates)
+            else:
+                changed = model.objects.remove_recipes(user_id, candidates)
+            change_recipe_counters(model, changed, sign)
+            if after_change is not None:
+                after_change(list(changed), [user_id], sign=sign)
+
+        success = status.HTTP_201_CREATED if adding else status.HTTP_204_NO_CONTENT
+        results = []
+        for recipe_id in recipe_ids:
+            if recipe_id not in linked:
+                result = {
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "errors": "Рецепт не найден",
+                }
+            elif recipe_id not in changed:
+                result = {"status": status.HTTP_400_BAD_REQUEST, "errors": error}
+            else:
+                result = {"status": success}
+            results.append({"id": recipe_id, **result})
+        return Response({"results": results})
 
     @action(
-        detail=True, methods=["post", "delete"], permission_classes=[IsAuthenticated]
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[IsAuthenticated],
+        url_path="favorite",
+        url_name="favorite-bulk",
     )
-    def shopping_cart(self, request, pk=None):
+    def favorite_bulk(self, request):
         if request.method == "POST":
-            try:
-
-                recipe = get_object_or_404(Recipe, pk=pk)
-
-                cart_exists = request.user.shopping_cart_items.filter(
-                    recipe=recipe
-                ).exists()
-                if cart_exists:
-                    return Response(
-                        {"errors": "Рецепт уже в списке покупок"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
+            return self.change_recipes_in(Favorite, "Рецепт уже в избранном")
+        return self.change_recipes_in(Favorite, "Рецепт не в избранном")
 
-                # Создаем запись в корзине
-                ShoppingCart.objects.create(user=request.user, recipe=recipe)
-                serializer = RecipeShortSerializer(recipe, context={"request": request})
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            except:
-                return Response(
-                    {"detail": "No Recipe matches the given query."},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-        if request.method == "DELETE":
-            try:
-
-                recipe = get_object_or_404(Recipe, pk=pk)
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[IsAuthenticated],
+        url_path="shopping_cart",
+        url_name="shopping-cart-bulk",
+    )
+    def shopping_cart_bulk(self, request):
+        if request.method == "POST":
+            error = "Рецепт уже в списке покупок"
+        else:
+            error = "Рецепт не в списке покупок"
+        return self.change_recipes_in(
+            ShoppingCart, error, after_change=change_recipes_in_shopping_lists
+        )
 
-                cart = request.user.shopping_cart_items.filter(recipe=recipe)
-                if not cart.exists():
-                    return Response(
-                        {"errors": "Рецепт не в списке покупок"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
+    @action(
+        detail=True, methods=["post", "delete"], permission_classes=[IsAuthenticated]
+    )
+    def favorite(self, request, pk=None):
+        if request.method == "POST":
+            return self.add_recipe_to(Favorite, "Рецепт уже в избранном")
+        return self.remove_recipe_from(Favorite, "Рецепт не в избранном")
 
-                # Удаляем запись
-                cart.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            except:
-                return Response(
-                    {"detail": "No Recipe matches the given query."},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
+    @action(
+        detail=True, methods=["post", "delete"], permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart(self, request, pk=None):
+        # Суммы ингредиентов в списке покупок меняются в той же транзакции
+        if request.method == "POST":
+            return self.add_recipe_to(
+                ShoppingCart,
+                "Рецепт уже в списке покупок",
+                after_change=change_recipes_in_shopping_lists,
+            )
+        return self.remove_recipe_from(
+            ShoppingCart,
+            "Рецепт не в списке покупок",
+            after_change=change_recipes_in_shopping_lists,
+        )
 
     @action(
         detail=True, methods=["get"], permission_classes=[AllowAny], url_path="get-link"
     )
     def get_link(self, request, pk=None):
-        recipe = self.get_object()
-        link = request.build_absolute_uri(f"/recipes/{recipe.id}/")
+        short_code = get_object_or_404(
+            Recipe.objects.values_list("short_code", flat=True), pk=pk
+        )
+        # Пока backfill_short_codes не заполнил код, отдается полная ссылка
+        if short_code is None:
+            link = request.build_absolute_uri(f"/recipes/{pk}/")
+        else:
+            link = request.build_absolute_uri(f"/s/{short_code}/")
         return Response({"short-link": link})
 
-    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated])
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[
+            TextRenderer,
+            CSVRenderer,
+            ShoppingListJSONRenderer,
+            PDFRenderer,
+        ],
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = (
-            RecipeIngredient.objects.filter(recipe__shopping_cart__user=user)
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(total_amount=Sum("amount"))
+        """
+        Список покупок в формате из ?format= (txt, csv, json, pdf) или Accept.
+        Файл собирается построчно по мере отправки клиенту.
+        """
+        renderer = request.accepted_renderer
+        content = EXPORTERS[renderer.format](get_shopping_list(request.user))
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f"; charset={renderer.charset}"
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
         )
-        content = "Список покупок:\n\n"
-        for ingredient in ingredients:
-            content += (
-                f"{ingredient['ingredient__name']} "
-                f"({ingredient['ingredient__measurement_unit']}) — "
-                f"{ingredient['total_amount']}\n"
-            )
-        response = HttpResponse(content, content_type="text/plain")
-        response["Content-Disposition"] = 'attachment; filename="shopping_list.txt"'
         return response
+
+
+def redirect_short_link(request, code):
+    """
+    Переход по короткой ссылке /s/<код>/ на страницу рецепта. Коды
+    разрешаются из кэша, поэтому повторные переходы ботов и превью ссылок
+    не обращаются к БД. Перенаправление временное: рецепт могут удалить,
+    а постоянное браузеры запоминают.
+    """
+    try:
+        recipe_id = resolve_short_code(code)
+    except Recipe.DoesNotExist:
+        raise Http404
+    return HttpResponseRedirect(f"/recipes/{recipe_id}/")
+
+
+class ImageUploadViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Загрузка картинки по частям вместо base64 в JSON.
+
+    POST {"size": N} создает загрузку и возвращает токен. Части
+    отправляются PATCH с телом application/offset+octet-stream
+    и заголовком Upload-Offset, равным уже загруженному объему; тело
+    пишется на диск кусками, без разбора парсерами DRF. После обрыва
+    GET возвращает offset, с которого нужно продолжить. Токен
+    завершенной загрузки передается в поле image рецепта или avatar.
+    """
+
+    serializer_class = ImageUploadSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = "token"
+    lookup_value_regex = r"[0-9a-f]{32}"
+
+    def get_queryset(self):
+        return ImageUpload.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        delete_upload(instance)
+
+    def partial_update(self, request, token=None):
+        upload = self.get_object()
+        if request.content_type != UPLOAD_CONTENT_TYPE:
+            raise UnsupportedMediaType(request.content_type)
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {"Upload-Offset": "Укажите смещение части в заголовке Upload-Offset."}
+            )
+        try:
+            append_to_upload(upload, offset, request.stream or io.BytesIO())
+        except UploadConflict:
+            return Response(
+                {"offset": get_upload_offset(upload)}, status=status.HTTP_409_CONFLICT
+            )
+        except UploadTooLarge:
+            raise ValidationError(
+                {"size": f"Часть выходит за размер загрузки {upload.size} байт."}
+            )
+        return Response(self.get_serializer(upload).data)
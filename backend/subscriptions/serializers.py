@@ -45,7 +45,7 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         ).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_avatar(self, obj):
         if obj.avatar and hasattr(obj.avatar, "url"):
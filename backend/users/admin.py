@@ -1,6 +1,13 @@
+from collections import Counter
 from django.contrib import admin
+from django.db import transaction
+from recipes.cache import invalidate_author_recipes
+from recipes.counters import change_counter
 from .models import User, Subscription
 
+# Поля пользователя, которые входят в представления его рецептов
+AUTHOR_FIELDS = {"email", "username", "first_name", "last_name", "avatar"}
+
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -10,10 +17,40 @@ class UserAdmin(admin.ModelAdmin):
     ordering = ("username",)
     empty_value_display = "-пусто-"
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Как при изменении профиля через API
+        if change and AUTHOR_FIELDS.intersection(form.changed_data):
+            invalidate_author_recipes(obj)
+
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
+    """Подписки меняют счетчик подписчиков автора так же, как API."""
+
     list_display = ("id", "user", "subscriber")
     list_filter = ("user__username", "subscriber__username")
     search_fields = ("user__username", "subscriber__username")
     empty_value_display = "-пусто-"
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        change_counter(
+            User.objects.filter(pk=obj.subscriber_id), "subscribers_count", 1
+        )
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Subscription.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        authors = Counter(queryset.values_list("subscriber_id", flat=True))
+        queryset.delete()
+        for author_id, count in authors.items():
+            change_counter(
+                User.objects.filter(pk=author_id), "subscribers_count", -count
+            )
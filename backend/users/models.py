@@ -15,6 +15,14 @@ class User(AbstractUser):
     avatar = models.ImageField(
         upload_to="users/avatars/", blank=True, null=True, verbose_name="Аватар"
     )
+    # Обновляются вместе с рецептами и подписками, расхождения исправляет
+    # команда reconcile_counters
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Число рецептов"
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Число подписчиков"
+    )
 
     class Meta:
         verbose_name = "Пользователь"
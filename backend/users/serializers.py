@@ -2,6 +2,8 @@ import re
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from .models import User, Subscription
+from recipes.cache import invalidate_author_recipes
+from recipes.uploads import open_upload
 from utils.serializers import Base64ImageField
 from rest_framework.exceptions import AuthenticationFailed
 
@@ -32,12 +34,17 @@ class CustomUserCreateSerializer(BaseUserCreateSerializer):
 
 
 class AvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField()
+    avatar = Base64ImageField(open_upload=open_upload)
 
     class Meta:
         model = User
         fields = ("avatar",)
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        invalidate_author_recipes(instance)
+        return instance
+
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
@@ -54,12 +61,20 @@ class UserSerializer(serializers.ModelSerializer):
             "avatar",
         )
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        invalidate_author_recipes(instance)
+        return instance
+
     def to_representation(self, instance):
         if instance.is_anonymous:
             raise AuthenticationFailed("Authentication credentials were not provided.")
         return super().to_representation(instance)
 
     def get_is_subscribed(self, obj):
+        is_subscribed = getattr(obj, "is_subscribed", None)
+        if is_subscribed is not None:
+            return is_subscribed
         user = self.context["request"].user
         if user.is_anonymous:
             return False
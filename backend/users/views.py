@@ -2,8 +2,11 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
 from .models import User, Subscription
+from recipes.cache import invalidate_author_recipes
+from recipes.counters import change_counter
 from .serializers import UserSerializer, AvatarSerializer
 from subscriptions.serializers import SubscriptionSerializer
 
@@ -26,9 +29,14 @@ class UserViewSet(viewsets.ModelViewSet):
                     {"error": "Нельзя подписаться на себя"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            subscription, created = Subscription.objects.get_or_create(
-                user=user, subscriber=author
-            )
+            with transaction.atomic(savepoint=False):
+                subscription, created = Subscription.objects.get_or_create(
+                    user=user, subscriber=author
+                )
+                if created:
+                    change_counter(
+                        User.objects.filter(pk=author.pk), "subscribers_count", 1
+                    )
             if not created:
                 return Response(
                     {"error": "Вы уже подписаны"}, status=status.HTTP_400_BAD_REQUEST
@@ -37,12 +45,16 @@ class UserViewSet(viewsets.ModelViewSet):
             serializer = SubscriptionSerializer(author, context={"request": request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if request.method == "DELETE":
-            subscription = user.subscriptions.filter(subscriber=author)
-            if not subscription.exists():
+            with transaction.atomic(savepoint=False):
+                deleted, _ = user.subscriptions.filter(subscriber=author).delete()
+                if deleted:
+                    change_counter(
+                        User.objects.filter(pk=author.pk), "subscribers_count", -1
+                    )
+            if not deleted:
                 return Response(
                     {"error": "Вы не подписаны"}, status=status.HTTP_400_BAD_REQUEST
                 )
-            subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -60,15 +72,19 @@ class UserViewSet(viewsets.ModelViewSet):
                     {"avatar": ["This field is required."]},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            serializer = AvatarSerializer(user, data=request.data, partial=True)
+            serializer = AvatarSerializer(
+                user, data=request.data, partial=True, context={"request": request}
+            )
             serializer.is_valid(raise_exception=True)
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         elif request.method == "DELETE":
             if user.avatar:
-                user.avatar.delete()
+                # Файл может быть общим с другими пользователями, его удалит
+                # collect_media_garbage, когда на него не останется ссылок
                 user.avatar = None
-                user.save()
+                user.save(update_fields=["avatar"])
+                invalidate_author_recipes(user)
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
                 {"error": "Аватар не установлен"}, status=status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,34 @@
+import hashlib
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Строит ETag из значений, от которых зависит тело ответа."""
+    return quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest())
+
+
+def set_validators(response, etag, last_modified=None, vary=()):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    if vary:
+        patch_vary_headers(response, vary)
+    return response
+
+
+def conditional_response(request, etag, last_modified=None, vary=()):
+    """
+    Возвращает ответ 304, если копия клиента актуальна (If-None-Match,
+    If-Modified-Since), иначе None. Тело ответа при этом не строится.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return None
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()),
+    )
+    if response is None:
+        return None
+    return set_validators(response, etag, last_modified, vary)
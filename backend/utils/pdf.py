@@ -0,0 +1,62 @@
+import io
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 50
+FONT_SIZE = 12
+LEADING = 16
+LINES_PER_PAGE = int((PAGE_HEIGHT - 2 * MARGIN) // LEADING)
+CHUNK_SIZE = 64 * 1024
+
+
+def register_font(font_path):
+    """Регистрирует TrueType-шрифт в reportlab один раз на процесс."""
+    name = f"font:{font_path}"
+    if name not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(name, font_path))
+    return name
+
+
+def render_pdf(lines, font_path, title=None):
+    """
+    Генератор PDF-документа со строками lines, по LINES_PER_PAGE строк
+    на странице. Строки читаются по одной, как из курсора БД, и сразу
+    рисуются на странице. Документ собирает reportlab: он встраивает
+    только использованные глифы шрифта font_path, чтобы кириллица
+    отображалась без шрифтов у читателя. Готовый файл отдается частями.
+    """
+    font = register_font(font_path)
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    text = None
+    count = 0
+
+    def write(line):
+        nonlocal text, count
+        if text is None:
+            text = pdf.beginText(MARGIN, PAGE_HEIGHT - MARGIN - FONT_SIZE)
+            text.setFont(font, FONT_SIZE, LEADING)
+        text.textLine(line)
+        count += 1
+        if count == LINES_PER_PAGE:
+            pdf.drawText(text)
+            pdf.showPage()
+            text, count = None, 0
+
+    if title:
+        write(title)
+        write("")
+    for line in lines:
+        write(line)
+    if text is not None:
+        pdf.drawText(text)
+    # Последняя неполная страница или единственная пустая
+    if text is not None or pdf.getPageNumber() == 1:
+        pdf.showPage()
+    pdf.save()
+    data = output.getbuffer()
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield bytes(data[start : start + CHUNK_SIZE])
@@ -1,16 +1,148 @@
 import base64
+import binascii
+import io
+import re
 import uuid
-from io import BytesIO
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from PIL import Image, UnidentifiedImageError
 from rest_framework import serializers
 
+DATA_URI_HEADER = re.compile(r"data:image/[\w.+-]+;base64,")
+WHITESPACE = re.compile(r"\s+")
+# Токен загрузки по частям (ImageUpload.token.hex)
+UPLOAD_TOKEN = re.compile(r"[0-9a-f]{32}")
+# Длина кусков base64 кратна 4, чтобы каждый декодировался отдельно
+CHUNK_SIZE = 64 * 1024
+# Сигнатуры поддерживаемых форматов: формат PIL -> (смещение, байты)
+SIGNATURES = {
+    "PNG": (0, b"\x89PNG\r\n\x1a\n"),
+    "JPEG": (0, b"\xff\xd8\xff"),
+    "GIF": (0, b"GIF8"),
+    "WEBP": (8, b"WEBP"),
+}
+EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "GIF": "gif", "WEBP": "webp"}
+CONTENT_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Картинка в виде data URI. Размер проверяется по длине base64 до
+    декодирования. Декодирование идет кусками, как загрузка файла в Django:
+    в память, если картинка не больше FILE_UPLOAD_MAX_MEMORY_SIZE, иначе
+    во временный файл на диске, который хранилище потом перемещает без
+    копирования. До проверки картинки PIL сверяются сигнатура формата
+    и размеры в пикселях из заголовка.
+
+    Если передан open_upload(user, token), вместо data URI можно передать
+    токен завершенной загрузки по частям (/api/uploads/): файл загрузки
+    проверяется так же и перемещается в хранилище без декодирования.
+    """
+
+    default_error_messages = {
+        "too_large": "Размер картинки превышает {max_size} МБ.",
+        "invalid_base64": "Картинка должна быть закодирована в base64.",
+        "unsupported": "Поддерживаются картинки PNG, JPEG, GIF и WebP.",
+        "too_many_pixels": "Размер картинки превышает {max_pixels} пикселей.",
+        "upload_not_found": "Загрузка не найдена или не завершена.",
+    }
+
+    def __init__(self, *args, open_upload=None, **kwargs):
+        self.upload_opener = open_upload
+        super().__init__(*args, **kwargs)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
-            format, imgstr = data.split(";base64,")
-            ext = format.split("/")[-1]
-            decoded_file = base64.b64decode(imgstr)
-            file_name = f"{uuid.uuid4()}.{ext}"
-            data = ContentFile(decoded_file, name=file_name)
+            data = self.decode(data)
+        elif (
+            isinstance(data, str)
+            and self.upload_opener is not None
+            and UPLOAD_TOKEN.fullmatch(data)
+        ):
+            data = self.open_upload(data)
         return super().to_internal_value(data)
+
+    def open_upload(self, token):
+        file = self.upload_opener(self.context["request"].user, token)
+        if file is None:
+            self.fail("upload_not_found")
+        file.seek(0, io.SEEK_END)
+        try:
+            image_format = self.check_image(file)
+        except serializers.ValidationError:
+            file.close()
+            raise
+        return self.prepare(file, image_format)
+
+    def prepare(self, file, image_format):
+        """Имя и тип файла по формату из сигнатуры."""
+        file.size = file.tell()
+        file.seek(0)
+        file.name = f"{uuid.uuid4()}.{EXTENSIONS[image_format]}"
+        file.content_type = CONTENT_TYPES[image_format]
+        return file
+
+    def decode(self, data):
+        header = DATA_URI_HEADER.match(data, 0, 100)
+        if header is None:
+            self.fail("invalid_base64")
+        # base64 из некоторых кодировщиков разбит на строки по 76 символов
+        data = WHITESPACE.sub("", data[header.end() :])
+        # Каждые 4 символа base64 дают не больше 3 байт
+        size = len(data) // 4 * 3
+        max_size = settings.MAX_IMAGE_UPLOAD_SIZE
+        if size > max_size:
+            self.fail("too_large", max_size=max_size // (1024 * 1024))
+
+        # Имя и тип станут известны после проверки сигнатуры
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            file = TemporaryUploadedFile("image", None, 0, None)
+        else:
+            file = InMemoryUploadedFile(io.BytesIO(), None, "image", None, 0, None)
+        try:
+            for offset in range(0, len(data), CHUNK_SIZE):
+                file.write(
+                    base64.b64decode(data[offset : offset + CHUNK_SIZE], validate=True)
+                )
+            image_format = self.check_image(file)
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail("invalid_base64")
+        except serializers.ValidationError:
+            file.close()
+            raise
+        return self.prepare(file, image_format)
+
+    def check_image(self, file):
+        """
+        Формат по сигнатуре и размеры по заголовку: PIL.Image.open читает
+        только заголовок, пиксели не декодируются.
+        """
+        size = file.tell()
+        file.seek(0)
+        head = file.read(16)
+        image_format = next(
+            (
+                image_format
+                for image_format, (offset, signature) in SIGNATURES.items()
+                if head[offset : offset + len(signature)] == signature
+            ),
+            None,
+        )
+        if image_format is None:
+            self.fail("unsupported")
+        file.seek(0)
+        try:
+            with Image.open(file, formats=[image_format]) as image:
+                width, height = image.size
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+            self.fail("invalid_image")
+        if width * height > settings.MAX_IMAGE_PIXELS:
+            self.fail("too_many_pixels", max_pixels=settings.MAX_IMAGE_PIXELS)
+        file.seek(size)
+        return image_format
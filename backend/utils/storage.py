@@ -0,0 +1,51 @@
+import hashlib
+import os
+import posixpath
+import uuid
+from django.core.files.storage import FileSystemStorage
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """
+    Файловое хранилище с именами по содержимому:
+    <каталог>/<2 символа sha256>/<sha256><расширение>.
+
+    Одинаковые загрузки в один каталог сохраняются одним файлом, поэтому
+    файлы не перезаписываются и их URL можно кэшировать навсегда. Файлы
+    могут быть общими для нескольких записей: удалять их при удалении
+    записи нельзя, неиспользуемые файлы удаляет команда
+    collect_media_garbage.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Настоящее имя вычисляется по содержимому в _save
+        return name
+
+    def get_hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, file_name = posixpath.split(name)
+        extension = posixpath.splitext(file_name)[1].lower()
+        digest = digest.hexdigest()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            # Свежее время изменения защищает файл от collect_media_garbage,
+            # пока запись, которая на него ссылается, не сохранена
+            os.utime(self.path(name))
+            if hasattr(content, "temporary_file_path"):
+                # Как и при перемещении в super()._save, временный файл
+                # после сохранения не остается
+                os.remove(content.temporary_file_path())
+            return name
+        # Пишем под уникальным именем и атомарно переименовываем: при
+        # параллельной загрузке того же содержимого побеждает любой
+        # из одинаковых файлов
+        temporary_name = super()._save(f"{name}.{uuid.uuid4().hex}.part", content)
+        os.replace(self.path(temporary_name), self.path(name))
+        return name